@@ -1,28 +1,227 @@
 from django.contrib import admin
+from django.contrib.admin import helpers
+from django.core.paginator import Paginator
+from django.db.models import Max
+from django.forms.models import BaseInlineFormSet
+from django.http import QueryDict
+from django.shortcuts import render
+from django.utils.functional import cached_property
 
 # Register your models here.
-from .models import Category, Account, Transaction
+from .forms import CategoryActionForm, TagActionForm
+from .models import Category, CategoryRule, Account, Transaction, ImportJob
+from .models import purge_accounts, bulk_add_tags, recategorize, apply_category_rules, unmatch_transfer
+from .search import filter_description
 
 admin.site.register(Category)
 
-class TransactionInlineDr(admin.TabularInline):
+# Changelists larger than this are not counted exactly
+ESTIMATED_COUNT_THRESHOLD = 10000
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Paginator that stops counting past ESTIMATED_COUNT_THRESHOLD rows
+    An unfiltered list is then sized from the highest primary key, which is
+    an index read; a filtered one is capped at the threshold
+    """
+    @cached_property
+    def count(self):
+        bounded = self.object_list[:ESTIMATED_COUNT_THRESHOLD + 1].count()
+        if bounded <= ESTIMATED_COUNT_THRESHOLD:
+            return bounded
+        if not self.object_list.query.where:
+            model = self.object_list.model
+            highest = model._default_manager.aggregate(highest=Max('pk'))['highest']
+            return max(highest or 0, bounded)
+        return bounded
+
+class PaginatedInlineFormSet(BaseInlineFormSet):
+    """
+    Inline formset showing one page of related objects, newest first, loaded
+    on demand
+    The page is chosen with a ?<fk>_page= query parameter; without one nothing
+    is queried and only a link to the first page is shown
+    """
+    per_page = 20
+    page = None
+    page_param = 'page'
+    query = None
+
+    def get_queryset(self):
+        if not hasattr(self, '_page_queryset'):
+            queryset = super().get_queryset()
+            if self.page is None:
+                self._page_queryset = queryset.none()
+            else:
+                start = (self.page - 1) * self.per_page
+                self._page_queryset = queryset[start:start + self.per_page]
+        return self._page_queryset
+
+    @property
+    def has_next(self):
+        return self.page is not None and len(self.get_queryset()) == self.per_page
+
+    def page_query(self, page):
+        """
+        Query string of the current page's URL showing another page of this inline
+        """
+        query = (self.query or QueryDict()).copy()
+        query[self.page_param] = page
+        return query.urlencode()
+
+    @property
+    def first_query(self):
+        return self.page_query(1)
+
+    @property
+    def newer_query(self):
+        return self.page_query(self.page - 1)
+
+    @property
+    def older_query(self):
+        return self.page_query(self.page + 1)
+
+class TransactionInline(admin.TabularInline):
     model = Transaction
-    fk_name = "dr"
+    formset = PaginatedInlineFormSet
+    template = 'admin/finances/paginated_tabular.html'
     readonly_fields = ('description', 'timestamp', 'amount', 'dr', 'cr', 'category', 'tags')
+    ordering = ('-timestamp', '-id')
     can_delete = False
+    extra = 0
+    max_num = 0
 
-class TransactionInlineCr(admin.TabularInline):
-    model = Transaction
+    def get_queryset(self, request):
+        return super().get_queryset(request).select_related('dr', 'cr', 'category').prefetch_related('tags')
+
+    def get_formset(self, request, obj=None, **kwargs):
+        formset = super().get_formset(request, obj, **kwargs)
+        formset.page_param = '%s_page' % self.fk_name
+        # Other parameters, such as _changelist_filters, stay in the page links
+        formset.query = request.GET
+        if formset.page_param in request.GET:
+            try:
+                formset.page = max(int(request.GET[formset.page_param]), 1)
+            except ValueError:
+                formset.page = 1
+        return formset
+
+class TransactionInlineDr(TransactionInline):
+    fk_name = "dr"
+    verbose_name_plural = "debits"
+
+class TransactionInlineCr(TransactionInline):
     fk_name = "cr"
-    readonly_fields = ('description', 'timestamp', 'amount', 'dr', 'cr', 'category', 'tags')
-    can_delete = False
+    verbose_name_plural = "credits"
 
 @admin.register(Account)
 class AccountAdmin(admin.ModelAdmin):
     list_display = ('name', 'description', 'owner')
     exclude = ('current_balance',)
-    # inlines = [TransactionInlineDr, TransactionInlineCr]
+    inlines = [TransactionInlineDr, TransactionInlineCr]
+    actions = ['queue_import', 'purge']
+
+    def queue_import(self, request, queryset):
+        queued = 0
+        for account in queryset:
+            if account.transaction_file:
+                account.queue_import()
+                queued += 1
+        self.message_user(request, "Queued %d statement import(s)." % queued)
+    queue_import.short_description = "Re-import transaction file"
+
+    def purge(self, request, queryset):
+        count = queryset.count()
+        deleted = purge_accounts(queryset)
+        self.message_user(request, "Deleted %d account(s) and %d transaction(s)." % (count, deleted))
+    purge.short_description = "Delete selected accounts and their transactions"
 
 @admin.register(Transaction)
 class TransactionAdmin(admin.ModelAdmin):
-    list_display = ('__str__', 'timestamp', 'description')
+    list_display = ('__str__', 'timestamp', 'description', 'category')
+    list_select_related = ('dr', 'cr', 'category')
+    list_filter = ('category', 'dr', 'cr')
+    date_hierarchy = 'timestamp'
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    search_fields = ('description',)
+    actions = ['recategorize', 'add_tags', 'unmatch_transfers']
+
+    def get_search_results(self, request, queryset, search_term):
+        # The whole term is matched through the description search index
+        search_term = search_term.strip()
+        if not search_term:
+            return queryset, False
+        return filter_description(queryset, search_term), False
+
+    def bulk_action_form(self, request, queryset, form_class, action, title):
+        """
+        Bound form for an action that needs input, or an intermediate page asking for it
+        """
+        form = form_class(request.POST if 'apply' in request.POST else None)
+        if form.is_valid():
+            return form, None
+        return form, render(request, 'admin/finances/bulk_action.html', {
+            **self.admin_site.each_context(request),
+            'title': title,
+            'opts': self.model._meta,
+            'form': form,
+            'action': action,
+            'count': queryset.count(),
+            'select_across': int(request.POST.get('select_across') == '1'),
+            # Django only runs a confirmed action when ids are posted, even
+            # with select_across, so they are always carried through
+            'selected': request.POST.getlist(helpers.ACTION_CHECKBOX_NAME),
+            'action_checkbox_name': helpers.ACTION_CHECKBOX_NAME,
+        })
+
+    def recategorize(self, request, queryset):
+        form, response = self.bulk_action_form(request, queryset, CategoryActionForm,
+                                               'recategorize', "Set category")
+        if response:
+            return response
+        updated = recategorize(queryset, form.cleaned_data['category'])
+        self.message_user(request, "Updated %d transaction(s)." % updated)
+    recategorize.short_description = "Set category of selected transactions"
+
+    def add_tags(self, request, queryset):
+        form, response = self.bulk_action_form(request, queryset, TagActionForm, 'add_tags', "Add tags")
+        if response:
+            return response
+        added = bulk_add_tags(queryset, form.cleaned_data['tags'])
+        self.message_user(request, "Added %d tag(s)." % added)
+    add_tags.short_description = "Tag selected transactions"
+
+    def unmatch_transfers(self, request, queryset):
+        transfers = queryset.filter(dr__isnull=False, cr__isnull=False, transfer_fingerprint__isnull=False)
+        count = 0
+        for transfer in transfers:
+            unmatch_transfer(transfer)
+            count += 1
+        self.message_user(request, "Split %d transfer(s)." % count)
+    unmatch_transfers.short_description = "Split selected matched transfers"
+
+@admin.register(CategoryRule)
+class CategoryRuleAdmin(admin.ModelAdmin):
+    list_display = ('__str__', 'priority', 'category', 'min_amount', 'max_amount', 'account', 'hits')
+    list_filter = ('category',)
+    actions = ['apply_rules', 'reset_hits']
+
+    def apply_rules(self, request, queryset):
+        changed = apply_category_rules(Transaction.objects.all())
+        self.message_user(request, "Categorized %d uncategorized transaction(s)." % changed)
+    apply_rules.short_description = "Apply all rules to uncategorized transactions"
+
+    def reset_hits(self, request, queryset):
+        queryset.update(hits=0)
+    reset_hits.short_description = "Reset hit counters"
+
+@admin.register(ImportJob)
+class ImportJobAdmin(admin.ModelAdmin):
+    list_display = ('account', 'statement', 'status', 'created', 'finished', 'rows_created', 'rows_per_sec', 'error')
+    list_filter = ('status',)
+    readonly_fields = ('account', 'statement', 'status', 'created', 'started', 'finished',
+                       'rows_created', 'rows_per_sec', 'error')
+
+    def has_add_permission(self, request):
+        return False
@@ -1,5 +1,10 @@
 from django.apps import AppConfig
+from django.db.backends.signals import connection_created
 
 
 class FinancesConfig(AppConfig):
     name = 'finances'
+
+    def ready(self):
+        from .routers import apply_pragmas
+        connection_created.connect(apply_pragmas, dispatch_uid='finances.apply_pragmas')
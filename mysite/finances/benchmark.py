@@ -0,0 +1,231 @@
+"""
+Synthetic statements and a benchmark harness
+
+generate_statement writes KiwiBank 'Basic' CSVs of any size. run_benchmark
+imports one into a fresh account and times the main paths; compare checks
+the results against a stored baseline. startup_profile measures what a new
+process pays before it does any work.
+"""
+import json
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import date, timedelta
+from decimal import Decimal
+
+from django.core.cache import cache
+from django.db import connection
+from django.test import Client
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.urls import reverse
+
+PREFIXES = ("POS W/D", "EFTPOS", "AP#", "DEBIT CARD", "BILL PAYMENT")
+MERCHANTS = ("SHOP", "SUPERMARKET", "CAFE", "PETROL", "PHARMACY", "POWER", "INTERNET", "RESTAURANT")
+
+# Whether a larger value of a metric is better; others should not grow
+HIGHER_IS_BETTER = ('import_rows_per_sec',)
+
+CENTS = Decimal('0.01')
+
+# Code run by a new process for each startup measurement: a WSGI worker up to
+# its first request (the URLconf is loaded then), and what every manage.py
+# command runs before its own code
+STARTUP_TARGETS = {
+    'wsgi': "from mysite.wsgi import application\n"
+            "from django.urls import get_resolver\n"
+            "get_resolver().url_patterns",
+    'setup': "import django\n"
+             "django.setup()",
+}
+
+# Modules reported as loaded, or not, at startup
+HEAVY_MODULES = ('numpy', 'pandas', 'django_pandas')
+
+STARTUP_REPORT = """
+import json, resource, sys
+rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+print(json.dumps({'rss_kb': rss // 1024 if sys.platform == 'darwin' else rss,
+                  'modules': len(sys.modules),
+                  'heavy': [name for name in %r if name in sys.modules]}))
+"""
+
+
+def descriptions(variety, rng):
+    """
+    variety distinct merchant descriptions
+    """
+    names = set()
+    while len(names) < variety:
+        names.add("%s %s %d" % (rng.choice(PREFIXES), rng.choice(MERCHANTS), rng.randint(1, 10 * variety)))
+    return sorted(names)
+
+
+def generate_statement(file, rows, account="38-9000-0000000-00", start=date(2015, 1, 1),
+                       days=365, variety=50, seed=0):
+    """
+    Write a KiwiBank 'Basic' CSV of rows transactions spread over days from start
+    Most rows are card payments with a time of day; every fortnight has a salary
+    """
+    rng = random.Random(seed)
+    names = descriptions(variety, rng)
+    offsets = sorted(rng.randrange(days) for _ in range(rows))
+    balance = Decimal(0)
+    file.write("%s,,,,\n" % account)
+    for offset in offsets:
+        day = start + timedelta(days=offset)
+        if offset % 14 == 0 and rng.random() < 0.5:
+            desc = "SALARY"
+            amount = (Decimal(rng.randint(150000, 250000)) / 100).quantize(CENTS)
+        else:
+            desc = "%s-%02d:%02d" % (rng.choice(names), rng.randint(7, 21), rng.randrange(60))
+            amount = (-Decimal(rng.randint(100, 30000)) / 100).quantize(CENTS)
+        balance += amount
+        file.write("%s,%s ;Ref,,%s,%s\n" % (day.strftime("%d %b %Y"), desc, amount, balance))
+
+
+def timed(function, *args, **kwargs):
+    """
+    (seconds, queries, result) of a call
+    """
+    with CaptureQueriesContext(connection) as queries:
+        start = time.perf_counter()
+        result = function(*args, **kwargs)
+        elapsed = time.perf_counter() - start
+    return elapsed, len(queries), result
+
+
+def run_benchmark(rows, repeat=3, variety=50, seed=0):
+    """
+    Metrics for an account of rows synthetic transactions
+    Meant for a throwaway database; the account is created and deleted
+    Times are in milliseconds, best of repeat; a private page cache is
+    cleared before each request so views are measured against the database
+    """
+    from .models import Account, process_account_csv
+    name = "benchmark-%d" % rows
+    directory = tempfile.mkdtemp()
+    path = os.path.join(directory, "statement.csv")
+    isolated = override_settings(
+        CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'benchmark'}},
+        FINANCES_SNAPSHOT_DIR=os.path.join(directory, 'snapshots'))
+    isolated.enable()
+    try:
+        with open(path, 'w') as file:
+            generate_statement(file, rows, account=name, days=max(rows // 10, 30), variety=variety, seed=seed)
+        account = Account.objects.create(name=name)
+        results = {'rows': rows}
+        elapsed, queries, created = timed(process_account_csv, path, name)
+        results['import_ms'] = elapsed * 1000
+        results['import_queries'] = queries
+        results['import_rows_per_sec'] = created / elapsed if elapsed else 0
+
+        client = Client()
+        pages = {
+            'detail': reverse('account-detail', args=[name]),
+            'ledger': reverse('account-ledger', args=[name]),
+            'ledger_json': reverse('account-ledger-json', args=[name]),
+            'report': reverse('category-report') + "?account=" + name,
+            'balance_series': reverse('account-balance-series', args=[name]),
+        }
+        for page, url in pages.items():
+            best = None
+            for _ in range(repeat):
+                cache.clear()
+                elapsed, queries, response = timed(client.get, url)
+                assert response.status_code == 200, (url, response.status_code)
+                best = elapsed if best is None else min(best, elapsed)
+            results['%s_ms' % page] = best * 1000
+            results['%s_queries' % page] = queries
+
+        elapsed, queries, _ = timed(account.process_transactions)
+        results['balance_ms'] = elapsed * 1000
+        results['balance_queries'] = queries
+        elapsed, queries, _ = timed(account.delete)
+        results['delete_ms'] = elapsed * 1000
+        results['delete_queries'] = queries
+        return results
+    finally:
+        isolated.disable()
+        shutil.rmtree(directory)
+
+
+def compare(results, baseline, tolerance=0.2):
+    """
+    Regressions of results against baseline, both {rows or startup target: metrics}
+    Times and rates may vary by tolerance (a fraction); query counts may not grow
+    Returns a list of (rows, metric, baseline value, new value)
+    """
+    regressions = []
+    for rows, metrics in sorted(results.items(), key=lambda item: (not item[0].isdigit(), item[0].zfill(20))):
+        previous = baseline.get(rows)
+        if previous is None:
+            continue
+        for metric, value in sorted(metrics.items()):
+            if metric not in previous or metric == 'rows':
+                continue
+            old = previous[metric]
+            if metric in HIGHER_IS_BETTER:
+                worse = value < old * (1 - tolerance)
+            elif metric.endswith('_queries'):
+                worse = value > old
+            else:
+                worse = value > old * (1 + tolerance)
+            if worse:
+                regressions.append((rows, metric, old, value))
+    return regressions
+
+
+def parse_importtime(output):
+    """
+    (total microseconds, [(cumulative microseconds, module)] of top-level
+    imports) from python -X importtime output
+    """
+    total = 0
+    top = []
+    for line in output.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        own, cumulative, module = line[len("import time:"):].split("|")
+        total += int(own)
+        # Nested imports are indented by two spaces per level
+        if len(module) - len(module.lstrip()) <= 1:
+            top.append((int(cumulative), module.strip()))
+    top.sort(reverse=True)
+    return total, top
+
+
+def startup_profile(target, repeat=5, settings_module=None, cwd=None):
+    """
+    Metrics of starting a new Python process and running one of STARTUP_TARGETS
+    Run with -X importtime, which adds a little to every import; times are
+    the best of repeat cold starts, in milliseconds
+    Returns (metrics, heaviest top-level imports, heavy modules loaded)
+    """
+    env = dict(os.environ, DJANGO_SETTINGS_MODULE=settings_module or os.environ['DJANGO_SETTINGS_MODULE'])
+    code = STARTUP_TARGETS[target] + STARTUP_REPORT % (HEAVY_MODULES,)
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        completed = subprocess.run([sys.executable, '-X', 'importtime', '-c', code], env=env, cwd=cwd,
+                                   stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+        elapsed = time.perf_counter() - start
+        if completed.returncode:
+            raise RuntimeError(completed.stderr.strip().splitlines()[-1])
+        if best is None or elapsed < best[0]:
+            best = (elapsed, completed)
+    elapsed, completed = best
+    report = json.loads(completed.stdout.strip().splitlines()[-1])
+    import_us, top = parse_importtime(completed.stderr)
+    metrics = {
+        'startup_ms': elapsed * 1000,
+        'import_ms': import_us / 1000,
+        'rss_kb': report['rss_kb'],
+        'modules': report['modules'],
+        'heavy_modules': len(report['heavy']),
+    }
+    return metrics, top, report['heavy']
+
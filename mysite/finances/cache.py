@@ -0,0 +1,119 @@
+"""
+Versioned page cache for the finances views
+
+Every cached page depends on a few version scopes: an account's name, the
+account list, or the whole ledger. Signals and bulk operations bump the
+versions of what they change, so page keys and ETags move on without
+having to find and delete stale entries. Versions are the time of the last
+change, which also serves as Last-Modified.
+"""
+import hashlib
+import time
+from datetime import datetime
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.utils import timezone
+from django.views.decorators.http import condition
+
+PAGE_TIMEOUT = getattr(settings, 'FINANCES_PAGE_CACHE_TIMEOUT', 600)
+
+# Scope of the account list
+ACCOUNTS = 'accounts'
+# Scope of any transaction, for pages covering every account
+LEDGER = 'ledger'
+# Scope every page depends on, for changes too broad to track
+ALL = 'all'
+
+
+def version_key(scope):
+    return "finances:version:%s" % scope
+
+
+def get_versions(scopes):
+    """
+    Current version of each scope, starting any that are unset at now
+    """
+    keys = [version_key(scope) for scope in scopes]
+    versions = cache.get_many(keys)
+    for key in keys:
+        if key not in versions:
+            cache.add(key, time.time(), None)
+            versions[key] = cache.get(key)
+    return [versions[key] for key in keys]
+
+
+def _bump(scopes):
+    now = time.time()
+    cache.set_many({version_key(scope): now for scope in scopes}, None)
+
+
+def bump(*scopes):
+    """
+    Move the versions of scopes on, now and again once the current
+    database transaction commits, so a page rendered from uncommitted
+    data is never cached under the new version
+    """
+    scopes = [scope for scope in scopes if scope is not None]
+    if not scopes:
+        return
+    _bump(scopes)
+    if transaction.get_connection().in_atomic_block:
+        transaction.on_commit(lambda: _bump(scopes))
+
+
+def invalidate(*names):
+    """
+    Bump the versions of the named accounts and of the whole ledger
+    """
+    bump(LEDGER, *names)
+
+
+def invalidate_all():
+    bump(ALL)
+
+
+def versioned_page(scopes):
+    """
+    Cache a view's responses under the versions of the scopes it depends on,
+    and answer conditional GETs from the versions alone
+    scopes(request, *args, **kwargs) lists them without using the database
+    """
+    def etag(request, *args, **kwargs):
+        versions = get_versions(scopes(request, *args, **kwargs))
+        key = "%s|%s" % (request.get_full_path(), "|".join(map(repr, versions)))
+        return hashlib.md5(key.encode('utf-8')).hexdigest()
+
+    def last_modified(request, *args, **kwargs):
+        return datetime.fromtimestamp(max(get_versions(scopes(request, *args, **kwargs))), timezone.utc)
+
+    def decorator(view):
+        @wraps(view)
+        def cached_view(request, *args, **kwargs):
+            if request.method not in ('GET', 'HEAD'):
+                return view(request, *args, **kwargs)
+            key = "finances:page:%s" % etag(request, *args, **kwargs)
+            response = cache.get(key)
+            if response is None:
+                response = view(request, *args, **kwargs)
+                if hasattr(response, 'render') and callable(response.render):
+                    response.render()
+                if response.status_code == 200 and not response.streaming:
+                    cache.set(key, response, PAGE_TIMEOUT)
+            return response
+        return condition(etag_func=etag, last_modified_func=last_modified)(cached_view)
+    return decorator
+
+
+def account_scopes(request, pk=None, **kwargs):
+    return [ALL, pk]
+
+
+def account_list_scopes(request, **kwargs):
+    return [ALL, ACCOUNTS]
+
+
+def report_scopes(request, **kwargs):
+    return [ALL] + (request.GET.getlist('account') or [LEDGER])
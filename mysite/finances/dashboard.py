@@ -0,0 +1,115 @@
+"""
+Dashboard figures, queried concurrently
+
+The dashboard's panels are independent aggregate queries. Rather than run
+them one after another, each runs on a thread of a bounded pool with its own
+database connection, and the page is built once all have finished, so it
+takes about as long as the slowest panel. Django 2.0 has neither async views
+nor an async ORM; the pool is what they would provide. Panels read through
+reporting(), so they use the reports database when one is configured.
+"""
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait
+
+from django.conf import settings
+from django.db import close_old_connections
+from django.db.models import Sum
+from django.utils import timezone
+
+from .models import CENTS, Account, MonthlyRollup, Transaction, month_start
+from .routers import reporting
+
+# Threads shared by every dashboard request in a process; 0 runs the panels
+# one after another in the request's thread
+DASHBOARD_WORKERS = getattr(settings, 'FINANCES_DASHBOARD_WORKERS', 4)
+RECENT_TRANSACTIONS = 10
+
+PANELS = {}
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def panel(name):
+    """
+    Register a function of the current time as a dashboard panel
+    """
+    def decorator(function):
+        PANELS[name] = function
+        return function
+    return decorator
+
+
+@panel('balances')
+def balances(now):
+    """
+    Each account's current balance, or None for an account never imported into
+    """
+    return [{'account': name, 'balance': str(balance.quantize(CENTS)) if balance is not None else None}
+            for name, balance in Account.objects.order_by('name').values_list('name', 'current_balance')]
+
+
+@panel('month_to_date')
+def month_to_date(now):
+    """
+    This month's net total by category across all accounts, so transfers
+    between accounts cancel out; spending is negative
+    """
+    totals = (MonthlyRollup.objects.filter(month=month_start(now).date())
+              .values('category').annotate(total=Sum('total')).order_by('total'))
+    return [{'category': row['category'], 'total': str(row['total'].quantize(CENTS))}
+            for row in totals if row['total']]
+
+
+@panel('recent')
+def recent(now):
+    transactions = Transaction.objects.order_by('-timestamp', '-id')[:RECENT_TRANSACTIONS]
+    return [{
+        'id': t['id'],
+        'timestamp': t['timestamp'].isoformat(),
+        'amount': str(t['amount']),
+        'description': t['description'],
+        'dr': t['dr'],
+        'cr': t['cr'],
+        'category': t['category'],
+    } for t in transactions.values('id', 'timestamp', 'amount', 'description', 'dr', 'cr', 'category')]
+
+
+@panel('uncategorized')
+def uncategorized(now):
+    return Transaction.objects.filter(category__isnull=True).count()
+
+
+def executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=DASHBOARD_WORKERS, thread_name_prefix='dashboard')
+        return _executor
+
+
+def run_panel(function, now):
+    """
+    Run a panel on a pool thread, closing the thread's connection afterwards
+    unless CONN_MAX_AGE keeps it, as at the end of a request
+    """
+    try:
+        with reporting():
+            return function(now)
+    finally:
+        close_old_connections()
+
+
+def dashboard(now=None):
+    """
+    {panel name: figures} for every panel
+    Panels run concurrently unless FINANCES_DASHBOARD_WORKERS is 0; an
+    exception in any of them is raised once all have finished
+    """
+    now = now or timezone.now()
+    if not DASHBOARD_WORKERS:
+        with reporting():
+            return {name: function(now) for name, function in PANELS.items()}
+    futures = {name: executor().submit(run_panel, function, now) for name, function in PANELS.items()}
+    wait(futures.values())
+    return {name: future.result() for name, future in futures.items()}
@@ -0,0 +1,120 @@
+"""
+Transaction exports
+
+An account's debits and credits are each read as an ordered range of their
+(account, timestamp) index and merged, so rows are written as soon as they
+are read instead of after a sort of the whole ledger. Each side is read in
+keyset-paginated chunks, each through values_list and iterator(), and
+formatted line by line, so memory stays flat however long the ledger.
+(SQLite cannot stream a single cursor, hence the chunks.)
+"""
+import csv
+import heapq
+import json
+from datetime import datetime, time, timedelta
+
+from django.utils import timezone
+
+from .models import Transaction
+
+EXPORT_CHUNK_SIZE = 2000
+
+FIELDS = ('id', 'timestamp', 'description', 'amount', 'category', 'dr', 'cr')
+
+FORMATS = {}
+
+
+def export_querysets(account, since=None, until=None, category=None):
+    """
+    {side: values_list queryset} of an account's debits ('dr') and credits
+    ('cr') to export, each in (timestamp, id) order
+    """
+    sides = {}
+    for side in ('dr', 'cr'):
+        transactions = Transaction.objects.filter(**{side: account})
+        if since is not None:
+            transactions = transactions.filter(timestamp__gte=timezone.make_aware(datetime.combine(since, time())))
+        if until is not None:
+            end = until + timedelta(days=1)
+            transactions = transactions.filter(timestamp__lt=timezone.make_aware(datetime.combine(end, time())))
+        if category == '':
+            transactions = transactions.filter(category__isnull=True)
+        elif category is not None:
+            transactions = transactions.filter(category=category)
+        sides[side] = (transactions.order_by('timestamp', 'id')
+                       .values_list('id', 'timestamp', 'description', 'amount', 'category', 'dr', 'cr'))
+    return sides
+
+
+def _side_rows(transactions, sign, chunk_size):
+    """
+    Rows of one side's queryset, in keyset-paginated chunks, with the amount
+    signed by its effect on the account
+    """
+    chunk = transactions
+    while True:
+        count = 0
+        for row in chunk[:chunk_size].iterator():
+            count += 1
+            yield row[:3] + (sign * abs(row[3]),) + row[4:]
+        if count < chunk_size:
+            return
+        pk, timestamp = row[0], row[1]
+        chunk = transactions.filter(timestamp__gte=timestamp).exclude(timestamp=timestamp, id__lte=pk)
+
+
+def export_rows(account, since=None, until=None, category=None, chunk_size=EXPORT_CHUNK_SIZE):
+    """
+    Tuples of FIELDS for an account's transactions, oldest first
+    amount is the effect on the account; since and until are inclusive dates
+    category is a category name, or '' for uncategorized transactions
+    """
+    sides = export_querysets(account, since, until, category)
+    # Credits first, so a transaction on both sides counts as a credit, as in signed_amount
+    merged = heapq.merge(_side_rows(sides['cr'], 1, chunk_size), _side_rows(sides['dr'], -1, chunk_size),
+                         key=lambda row: (row[1], row[0]))
+    previous = None
+    for row in merged:
+        if row[0] != previous:
+            yield row
+        previous = row[0]
+
+
+def export_format(name, content_type):
+    """
+    Register a function turning export rows into lines of text
+    """
+    def register(function):
+        FORMATS[name] = (function, content_type)
+        return function
+    return register
+
+
+class Echo:
+    """
+    File-like object whose write returns what was written, for csv.writer
+    """
+    def write(self, value):
+        return value
+
+
+@export_format('csv', 'text/csv')
+def csv_lines(rows):
+    writer = csv.writer(Echo())
+    yield writer.writerow(FIELDS)
+    for pk, timestamp, desc, amount, category, dr, cr in rows:
+        yield writer.writerow((pk, timezone.localtime(timestamp).isoformat(), desc, amount, category, dr, cr))
+
+
+@export_format('ndjson', 'application/x-ndjson')
+def ndjson_lines(rows):
+    for pk, timestamp, desc, amount, category, dr, cr in rows:
+        yield json.dumps({
+            'id': pk,
+            'timestamp': timezone.localtime(timestamp).isoformat(),
+            'description': desc,
+            'amount': str(amount),
+            'category': category,
+            'dr': dr,
+            'cr': cr,
+        }) + "\n"
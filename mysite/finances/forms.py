@@ -0,0 +1,24 @@
+from django import forms
+
+from .models import Category
+
+
+class CategoryActionForm(forms.Form):
+    """
+    Category to apply to selected transactions
+    """
+    category = forms.ModelChoiceField(Category.objects.all(), required=False, empty_label="(none)")
+
+
+class TagActionForm(forms.Form):
+    """
+    Tags to add to selected transactions
+    """
+    tags = forms.CharField(help_text="Comma-separated tag names")
+
+    def clean_tags(self):
+        names = [name.strip() for name in self.cleaned_data['tags'].split(",")]
+        names = [name for name in names if name]
+        if not names:
+            raise forms.ValidationError("Enter at least one tag.")
+        return names
@@ -0,0 +1,146 @@
+"""
+Per-request SQL and latency profiling
+
+A sampled fraction of requests run with an execute wrapper on every database
+connection, counting and timing their queries. Each profile is kept in a
+bounded in-memory ring buffer, for the staff profile page, and logged as JSON
+to the finances.profile logger; queries slower than FINANCES_SLOW_QUERY_MS
+are logged to finances.slow_query whether or not the request is sampled.
+"""
+import heapq
+import json
+import logging
+import random
+import threading
+import time
+from collections import Counter, deque
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.db import connections
+from django.utils import timezone
+
+SAMPLE_RATE = getattr(settings, 'FINANCES_PROFILE_SAMPLE_RATE', 0.1)
+BUFFER_SIZE = getattr(settings, 'FINANCES_PROFILE_BUFFER_SIZE', 1000)
+SLOW_QUERY_MS = getattr(settings, 'FINANCES_SLOW_QUERY_MS', 100)
+SLOWEST = 5
+
+profile_logger = logging.getLogger('finances.profile')
+slow_query_logger = logging.getLogger('finances.slow_query')
+
+profiles = deque(maxlen=BUFFER_SIZE)
+profiles_lock = threading.Lock()
+
+
+class QueryRecorder:
+    """
+    Execute wrapper timing the queries of one request
+    Every query is checked against the slow query threshold; only sampled
+    requests keep statistics. Statements are grouped by their SQL, which has
+    placeholders for parameters, so repeats of one statement are N+1 candidates
+    """
+
+    def __init__(self, path=None, sampled=True):
+        self.path = path
+        self.sampled = sampled
+        self.count = 0
+        self.seconds = 0.0
+        self.slowest = []
+        self.statements = Counter()
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            elapsed = time.perf_counter() - start
+            if elapsed * 1000 >= SLOW_QUERY_MS:
+                slow_query_logger.warning(json.dumps({
+                    'path': self.path, 'ms': round(elapsed * 1000, 1), 'sql': sql}))
+            if self.sampled:
+                self.count += 1
+                self.seconds += elapsed
+                self.statements[sql] += 1
+                if len(self.slowest) < SLOWEST:
+                    heapq.heappush(self.slowest, (elapsed, sql))
+                elif elapsed > self.slowest[0][0]:
+                    heapq.heapreplace(self.slowest, (elapsed, sql))
+
+    def duplicates(self):
+        return [(count, sql) for sql, count in self.statements.most_common() if count > 1]
+
+
+class QueryProfilingMiddleware:
+    """
+    Profile a sample of requests; FINANCES_PROFILE_SAMPLE_RATE is the fraction
+    Queries of streamed responses run after the view returns and are not counted
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        sampled = random.random() < SAMPLE_RATE
+        recorder = QueryRecorder(request.path, sampled)
+        start = time.perf_counter()
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(recorder))
+            response = self.get_response(request)
+        if sampled:
+            record(request, response, recorder, time.perf_counter() - start)
+        return response
+
+
+def record(request, response, recorder, seconds):
+    """
+    Keep and log the profile of a request
+    """
+    match = getattr(request, 'resolver_match', None)
+    profile = {
+        'timestamp': timezone.now().isoformat(),
+        'method': request.method,
+        'path': request.path,
+        'endpoint': match.view_name if match else request.path,
+        'status': response.status_code,
+        'ms': round(seconds * 1000, 1),
+        'queries': recorder.count,
+        'sql_ms': round(recorder.seconds * 1000, 1),
+        'slowest': [(round(elapsed * 1000, 1), sql)
+                    for elapsed, sql in sorted(recorder.slowest, reverse=True)],
+        'duplicates': recorder.duplicates()[:SLOWEST],
+    }
+    with profiles_lock:
+        profiles.append(profile)
+    profile_logger.info(json.dumps(profile))
+
+
+def worst_endpoints(limit=20):
+    """
+    Endpoints of the buffered profiles, slowest (by 95th percentile) first
+    """
+    with profiles_lock:
+        buffered = list(profiles)
+    endpoints = {}
+    for profile in buffered:
+        endpoints.setdefault(profile['endpoint'], []).append(profile)
+    summary = []
+    for endpoint, requests in endpoints.items():
+        times = sorted(profile['ms'] for profile in requests)
+        duplicates = Counter()
+        for profile in requests:
+            for count, sql in profile['duplicates']:
+                duplicates[sql] = max(duplicates[sql], count)
+        summary.append({
+            'endpoint': endpoint,
+            'requests': len(requests),
+            'mean_ms': sum(times) / len(times),
+            'p95_ms': times[min(len(times) - 1, int(len(times) * 0.95))],
+            'max_ms': times[-1],
+            'mean_queries': sum(profile['queries'] for profile in requests) / len(requests),
+            'max_sql_ms': max(profile['sql_ms'] for profile in requests),
+            'slowest': max((query for profile in requests for query in profile['slowest']), default=None),
+            'duplicates': [(count, sql) for sql, count in duplicates.most_common(3)],
+        })
+    summary.sort(key=lambda row: row['p95_ms'], reverse=True)
+    return summary[:limit]
@@ -0,0 +1,29 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from finances.models import Account, CategoryRule, Transaction, apply_category_rules
+
+
+class Command(BaseCommand):
+    help = "Categorize existing transactions with the category rules"
+
+    def add_arguments(self, parser):
+        parser.add_argument('names', nargs='*', help="Account names (default: all transactions)")
+        parser.add_argument('--overwrite', action='store_true',
+                            help="Recategorize transactions that already have a category")
+        parser.add_argument('--batch-size', type=int, default=None,
+                            help="Transactions read and updated per batch")
+
+    def handle(self, *args, **options):
+        transactions = Transaction.objects.all()
+        if options['names']:
+            accounts = Account.objects.filter(name__in=options['names'])
+            transactions = transactions.filter(dr__in=accounts) | transactions.filter(cr__in=accounts)
+        start = time.perf_counter()
+        changed = apply_category_rules(transactions, overwrite=options['overwrite'],
+                                       batch_size=options['batch_size'])
+        elapsed = time.perf_counter() - start
+        self.stdout.write(self.style.SUCCESS("Categorized %d transaction(s) in %.2fs" % (changed, elapsed)))
+        for rule in CategoryRule.objects.all():
+            self.stdout.write("%6d  %s" % (rule.hits, rule))
@@ -0,0 +1,60 @@
+import json
+import platform
+
+import django
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import setup_test_environment, teardown_test_environment
+
+from finances.benchmark import compare, run_benchmark
+
+
+class Command(BaseCommand):
+    help = ("Benchmark import, views, balances and deletion on synthetic statements "
+            "in a throwaway database, optionally against a baseline")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, nargs='+', default=[1000],
+                            help="Statement sizes to run, e.g. 1000 100000 1000000")
+        parser.add_argument('--repeat', type=int, default=3, help="Requests per view; the best is kept")
+        parser.add_argument('--output', help="Write the results as JSON to this file")
+        parser.add_argument('--baseline', help="JSON results of an earlier run to compare against")
+        parser.add_argument('--tolerance', type=float, default=0.2,
+                            help="Fraction by which times may exceed the baseline")
+
+    def handle(self, *args, **options):
+        baseline = None
+        if options['baseline']:
+            with open(options['baseline']) as file:
+                baseline = json.load(file)['results']
+        old_name = connection.settings_dict['NAME']
+        setup_test_environment()
+        connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        try:
+            results = {}
+            for rows in options['rows']:
+                self.stdout.write("Benchmarking %d rows" % rows)
+                results[str(rows)] = metrics = run_benchmark(rows, repeat=options['repeat'])
+                for metric, value in sorted(metrics.items()):
+                    self.stdout.write("  %-24s %12.1f" % (metric, value))
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+        if options['output']:
+            with open(options['output'], 'w') as file:
+                json.dump({
+                    'environment': {
+                        'python': platform.python_version(),
+                        'django': django.get_version(),
+                        'database': connection.vendor,
+                        'machine': platform.machine(),
+                    },
+                    'results': results,
+                }, file, indent=2, sort_keys=True)
+        if baseline is not None:
+            regressions = compare(results, baseline, options['tolerance'])
+            for rows, metric, old, new in regressions:
+                self.stderr.write("%s rows: %s %.1f -> %.1f" % (rows, metric, old, new))
+            if regressions:
+                raise CommandError("%d regression(s) against the baseline" % len(regressions))
+            self.stdout.write(self.style.SUCCESS("No regressions against the baseline"))
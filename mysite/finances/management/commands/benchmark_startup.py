@@ -0,0 +1,58 @@
+import json
+import platform
+
+import django
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from finances.benchmark import STARTUP_TARGETS, compare, startup_profile
+
+
+class Command(BaseCommand):
+    help = ("Measure cold start time, import time and memory of new WSGI workers and "
+            "management commands, optionally against a baseline")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--target', choices=sorted(STARTUP_TARGETS), nargs='+',
+                            default=sorted(STARTUP_TARGETS), help="Startups to measure")
+        parser.add_argument('--repeat', type=int, default=5, help="Cold starts per target; the best is kept")
+        parser.add_argument('--top', type=int, default=10, help="Heaviest top-level imports to list")
+        parser.add_argument('--output', help="Write the results as JSON to this file")
+        parser.add_argument('--baseline', help="JSON results of an earlier run to compare against")
+        parser.add_argument('--tolerance', type=float, default=0.2,
+                            help="Fraction by which times and memory may exceed the baseline")
+
+    def handle(self, *args, **options):
+        baseline = None
+        if options['baseline']:
+            with open(options['baseline']) as file:
+                baseline = json.load(file)['results']
+        results = {}
+        for target in options['target']:
+            self.stdout.write("Starting %s" % target)
+            metrics, top, heavy = startup_profile(target, repeat=options['repeat'],
+                                                  settings_module=settings.SETTINGS_MODULE, cwd=settings.BASE_DIR)
+            results[target] = metrics
+            for metric, value in sorted(metrics.items()):
+                self.stdout.write("  %-24s %12.1f" % (metric, value))
+            if heavy:
+                self.stdout.write("  loaded: %s" % ", ".join(heavy))
+            for cumulative, module in top[:options['top']]:
+                self.stdout.write("  %10.1f ms  %s" % (cumulative / 1000, module))
+        if options['output']:
+            with open(options['output'], 'w') as file:
+                json.dump({
+                    'environment': {
+                        'python': platform.python_version(),
+                        'django': django.get_version(),
+                        'machine': platform.machine(),
+                    },
+                    'results': results,
+                }, file, indent=2, sort_keys=True)
+        if baseline is not None:
+            regressions = compare(results, baseline, options['tolerance'])
+            for target, metric, old, new in regressions:
+                self.stderr.write("%s: %s %.1f -> %.1f" % (target, metric, old, new))
+            if regressions:
+                raise CommandError("%d regression(s) against the baseline" % len(regressions))
+            self.stdout.write(self.style.SUCCESS("No regressions against the baseline"))
@@ -0,0 +1,40 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.dateparse import parse_date
+
+from finances.export import FORMATS, export_rows
+from finances.models import Account
+
+
+def date_argument(value):
+    day = parse_date(value)
+    if day is None:
+        raise ValueError(value)
+    return day
+
+
+class Command(BaseCommand):
+    help = "Stream an account's transactions as CSV or NDJSON"
+
+    def add_arguments(self, parser):
+        parser.add_argument('name', help="Account name")
+        parser.add_argument('--format', choices=sorted(FORMATS), default='csv')
+        parser.add_argument('--since', type=date_argument, help="First date to include (YYYY-MM-DD)")
+        parser.add_argument('--until', type=date_argument, help="Last date to include (YYYY-MM-DD)")
+        parser.add_argument('--category',
+                            help="Only this category; an empty string selects uncategorized transactions")
+        parser.add_argument('--output', help="File to write (default: standard output)")
+
+    def handle(self, *args, **options):
+        try:
+            account = Account.objects.get(name=options['name'])
+        except Account.DoesNotExist:
+            raise CommandError("No account named %s" % options['name'])
+        lines, content_type = FORMATS[options['format']]
+        rows = export_rows(account, since=options['since'], until=options['until'],
+                           category=options['category'])
+        if options['output']:
+            with open(options['output'], 'w', newline='') as file:
+                file.writelines(lines(rows))
+        else:
+            for line in lines(rows):
+                self.stdout.write(line, ending='')
@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+from django.utils.dateparse import parse_date
+
+from finances.benchmark import generate_statement
+
+
+class Command(BaseCommand):
+    help = "Write a synthetic KiwiBank statement CSV"
+
+    def add_arguments(self, parser):
+        parser.add_argument('output', help="CSV file to write")
+        parser.add_argument('--rows', type=int, default=1000)
+        parser.add_argument('--account', default="38-9000-0000000-00", help="Account number in the header")
+        parser.add_argument('--start', type=parse_date, default="2015-01-01", help="First date (YYYY-MM-DD)")
+        parser.add_argument('--days', type=int, default=365, help="Number of days the rows are spread over")
+        parser.add_argument('--variety', type=int, default=50, help="Number of distinct descriptions")
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        with open(options['output'], 'w') as file:
+            generate_statement(file, options['rows'], account=options['account'], start=options['start'],
+                               days=options['days'], variety=options['variety'], seed=options['seed'])
+        self.stdout.write("Wrote %d rows to %s" % (options['rows'], options['output']))
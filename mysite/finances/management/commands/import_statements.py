@@ -0,0 +1,124 @@
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+import django
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+from finances.models import Account, import_rows
+from finances.parsers import timed_parse_statement_file
+
+EXTENSIONS = ('.csv', '.ofx', '.qif')
+
+
+class Command(BaseCommand):
+    help = ("Import every statement in a directory, parsing files in parallel worker "
+            "processes and writing them one at a time from this one")
+
+    def add_arguments(self, parser):
+        parser.add_argument('directory', help="Directory of CSV, OFX and QIF statements")
+        parser.add_argument('--account',
+                            help="Import every file into this account (default: the account named by "
+                                 "each file's name without its extension)")
+        parser.add_argument('--create', action='store_true', help="Create accounts that do not exist")
+        parser.add_argument('--jobs', type=int, default=os.cpu_count(),
+                            help="Parsing processes (default: one per core); 1 parses in this process")
+        parser.add_argument('--batch-size', type=int, help="Rows per INSERT")
+
+    def handle(self, *args, **options):
+        directory = options['directory']
+        if not os.path.isdir(directory):
+            raise CommandError("%s is not a directory" % directory)
+        paths = sorted(os.path.join(directory, name) for name in os.listdir(directory)
+                       if name.lower().endswith(EXTENSIONS))
+        if not paths:
+            raise CommandError("No statements in %s" % directory)
+        self.batch_size = options['batch_size']
+        self.names = {path: options['account'] or os.path.splitext(os.path.basename(path))[0] for path in paths}
+        self.create = options['create']
+        missing = set(self.names.values()) - set(Account.objects.filter(name__in=set(self.names.values()))
+                                                 .values_list('name', flat=True))
+        if missing and not self.create:
+            raise CommandError("No account named %s; use --create to add them" % ", ".join(sorted(missing)))
+
+        self.total = len(paths)
+        self.done = 0
+        self.failed = []
+        self.created = 0
+        start = time.perf_counter()
+        jobs = max(1, options['jobs'] or 1)
+        if jobs == 1 or len(paths) == 1:
+            for path in paths:
+                try:
+                    parsed = timed_parse_statement_file(path)
+                except Exception as e:
+                    self.report_failure(path, e)
+                else:
+                    self.write(path, *parsed)
+        else:
+            self.run_pool(paths, jobs)
+        elapsed = time.perf_counter() - start
+        self.stdout.write("Imported %d transactions from %d files in %.2fs (%.0f rows/sec)" % (
+            self.created, self.total - len(self.failed), elapsed, self.created / elapsed if elapsed else 0))
+        if self.failed:
+            raise CommandError("%d of %d files failed: %s" % (len(self.failed), self.total, ", ".join(self.failed)))
+
+    def run_pool(self, paths, jobs):
+        """
+        Parse in worker processes and write each statement here as it arrives
+        At most two files per worker are parsed ahead of the writer, which
+        bounds the rows held in memory
+        """
+        # Forked workers must not share this process's connections; spawned
+        # ones import the parser module afresh, so Django is set up for them
+        connections.close_all()
+        pending = iter(paths)
+        running = {}
+        with ProcessPoolExecutor(max_workers=jobs, initializer=django.setup) as pool:
+            for path in pending:
+                running[pool.submit(timed_parse_statement_file, path)] = path
+                if len(running) >= 2 * jobs:
+                    break
+            while running:
+                finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    path = running.pop(future)
+                    try:
+                        parsed = future.result()
+                    except Exception as e:
+                        self.report_failure(path, e)
+                    else:
+                        self.write(path, *parsed)
+                    for path in pending:
+                        running[pool.submit(timed_parse_statement_file, path)] = path
+                        break
+
+    def write(self, path, rows, content_hash, parse_seconds):
+        """
+        Import one parsed statement in its own database transaction
+        """
+        name = self.names[path]
+        if self.create:
+            Account.objects.get_or_create(name=name)
+        if content_hash == Account.objects.filter(name=name).values_list('transaction_file_hash', flat=True).first():
+            self.report(path, "unchanged since last import")
+            return
+        start = time.perf_counter()
+        try:
+            created = import_rows(rows, name, self.batch_size, label=path, content_hash=content_hash)
+        except Exception as e:
+            self.report_failure(path, e)
+            return
+        self.created += created
+        self.report(path, "%d of %d rows into %s (parsed in %.2fs, written in %.2fs)" % (
+            created, len(rows), name, parse_seconds, time.perf_counter() - start))
+
+    def report(self, path, message):
+        self.done += 1
+        self.stdout.write("[%d/%d] %s: %s" % (self.done, self.total, os.path.basename(path), message))
+
+    def report_failure(self, path, error):
+        self.failed.append(os.path.basename(path))
+        self.done += 1
+        self.stderr.write("[%d/%d] %s failed: %s" % (self.done, self.total, os.path.basename(path), error))
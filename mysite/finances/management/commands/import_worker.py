@@ -0,0 +1,34 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from finances.models import ImportJob
+
+
+class Command(BaseCommand):
+    help = "Run queued statement imports"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true',
+                            help="Exit when the queue is empty instead of polling")
+        parser.add_argument('--interval', type=float, default=2.0,
+                            help="Seconds to wait between polls of an empty queue")
+
+    def handle(self, *args, **options):
+        while True:
+            requeued = ImportJob.requeue_stale()
+            if requeued:
+                self.stderr.write("Queued %d stalled jobs again" % requeued)
+            job = ImportJob.claim_next()
+            if job is None:
+                if options['once']:
+                    return
+                time.sleep(options['interval'])
+                continue
+            self.stdout.write("Importing %s into %s" % (job.statement, job.account_id))
+            job.run()
+            if job.status == ImportJob.DONE:
+                self.stdout.write(self.style.SUCCESS(
+                    "%d rows (%.0f rows/sec)" % (job.rows_created, job.rows_per_sec or 0)))
+            else:
+                self.stderr.write(job.error)
@@ -0,0 +1,17 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+
+from finances.models import TRANSFER_WINDOW, match_transfers
+
+
+class Command(BaseCommand):
+    help = "Merge transfers imported from both accounts' statements into two-sided transactions"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--window-days', type=float, default=TRANSFER_WINDOW.total_seconds() / 86400,
+                            help="Largest number of days between the two sides of a transfer")
+
+    def handle(self, *args, **options):
+        matched = match_transfers(window=timedelta(days=options['window_days']))
+        self.stdout.write("Matched %d transfers" % matched)
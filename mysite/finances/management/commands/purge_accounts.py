@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from finances.models import Account, purge_accounts
+
+
+class Command(BaseCommand):
+    help = "Delete accounts together with all of their transactions"
+
+    def add_arguments(self, parser):
+        parser.add_argument('names', nargs='+', help="Account names")
+
+    def handle(self, *args, **options):
+        accounts = Account.objects.filter(name__in=options['names'])
+        missing = set(options['names']) - set(accounts.values_list('name', flat=True))
+        if missing:
+            raise CommandError("No such account(s): %s" % ", ".join(sorted(missing)))
+        deleted = purge_accounts(accounts)
+        self.stdout.write(self.style.SUCCESS(
+            "Deleted %d account(s) and %d transaction(s)" % (len(options['names']), deleted)))
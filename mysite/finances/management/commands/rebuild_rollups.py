@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from finances.models import Account, MonthlyRollup
+
+
+class Command(BaseCommand):
+    help = "Rebuild monthly category rollups from the transaction table, or check them against it"
+
+    def add_arguments(self, parser):
+        parser.add_argument('names', nargs='*', help="Account names (default: all accounts)")
+        parser.add_argument('--check', action='store_true',
+                            help="Only compare the rollups with a full aggregate and report differences")
+
+    def handle(self, *args, **options):
+        accounts = Account.objects.all()
+        if options['names']:
+            accounts = accounts.filter(name__in=options['names'])
+        inconsistent = 0
+        for account in accounts:
+            if options['check']:
+                for month, category, stored, expected in MonthlyRollup.objects.inconsistencies(account):
+                    inconsistent += 1
+                    self.stdout.write("%s %s %s: stored %s, expected %s" % (
+                        account.name, month.strftime("%Y-%m"), category, stored, expected))
+            else:
+                MonthlyRollup.objects.refresh(account)
+                self.stdout.write("Rebuilt rollups for %s" % account.name)
+        if inconsistent:
+            raise CommandError("%d inconsistent rollup(s)" % inconsistent)
@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+
+from finances.search import create_index, fts_supported, has_index, rebuild_index
+
+
+class Command(BaseCommand):
+    help = "Rebuild the full-text index of transaction descriptions, creating it if missing"
+
+    def handle(self, *args, **options):
+        if not fts_supported(connection):
+            raise CommandError("The database does not support FTS5 trigram indexes (SQLite 3.34+)")
+        with transaction.atomic():
+            if has_index(connection):
+                rebuild_index(connection)
+            else:
+                create_index(connection)
+        self.stdout.write(self.style.SUCCESS("Rebuilt the transaction search index"))
@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from finances.models import Account
+from finances.snapshot import rebuild_snapshot
+
+
+class Command(BaseCommand):
+    help = "Rebuild the columnar ledger snapshots from the transaction table"
+
+    def add_arguments(self, parser):
+        parser.add_argument('names', nargs='*', help="Account names (default: all accounts)")
+
+    def handle(self, *args, **options):
+        accounts = Account.objects.all()
+        if options['names']:
+            accounts = accounts.filter(name__in=options['names'])
+        for account in accounts:
+            snapshot = rebuild_snapshot(account)
+            self.stdout.write("Rebuilt snapshot of %s (%d rows)" % (account.name, len(snapshot)))
@@ -0,0 +1,26 @@
+import sqlite3
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+
+class Command(BaseCommand):
+    help = "Copy the database into the report replica (FINANCES_REPORT_REPLICA) with SQLite's backup API"
+
+    def handle(self, *args, **options):
+        replica = getattr(settings, 'FINANCES_REPORT_REPLICA', None)
+        if not replica:
+            raise CommandError("FINANCES_REPORT_REPLICA is not set")
+        connection = connections['default']
+        if connection.vendor != 'sqlite':
+            raise CommandError("Report replicas are only supported for SQLite")
+        connection.ensure_connection()
+        # The copy is taken in one step, so readers of the replica see either
+        # the previous copy or the new one
+        destination = sqlite3.connect(replica)
+        try:
+            connection.connection.backup(destination)
+        finally:
+            destination.close()
+        self.stdout.write(self.style.SUCCESS("Refreshed %s" % replica))
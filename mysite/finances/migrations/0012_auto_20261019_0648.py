@@ -0,0 +1,23 @@
+# Generated by Django 2.0.13 on 2026-10-18 17:48
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('finances', '0011_auto_20180124_1919'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='account',
+            name='transaction_file_hash',
+            field=models.CharField(blank=True, editable=False, help_text='SHA-256 of the last imported statement', max_length=64, null=True),
+        ),
+        migrations.AddField(
+            model_name='transaction',
+            name='fingerprint',
+            field=models.CharField(blank=True, editable=False, help_text='Identity of the statement row this was imported from', max_length=64, null=True, unique=True),
+        ),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 2.0.13 on 2026-10-18 17:49
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('finances', '0012_auto_20261019_0648'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ImportJob',
+            fields=[
+                ('id', models.AutoField(primary_key=True, serialize=False)),
+                ('statement', models.CharField(help_text='Storage name of the statement file', max_length=255)),
+                ('status', models.CharField(choices=[('queued', 'Queued'), ('running', 'Running'), ('done', 'Done'), ('failed', 'Failed')], db_index=True, default='queued', max_length=10)),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('started', models.DateTimeField(blank=True, null=True)),
+                ('finished', models.DateTimeField(blank=True, null=True)),
+                ('rows_created', models.PositiveIntegerField(default=0)),
+                ('rows_per_sec', models.FloatField(blank=True, null=True)),
+                ('error', models.TextField(blank=True)),
+                ('account', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='finances.Account')),
+            ],
+            options={
+                'ordering': ['-created'],
+            },
+        ),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 2.0.13 on 2026-10-18 17:51
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('finances', '0013_importjob'),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name='balance',
+            options={'ordering': ['timestamp']},
+        ),
+        migrations.AlterUniqueTogether(
+            name='balance',
+            unique_together={('account', 'timestamp')},
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 2.0.13 on 2026-10-18 17:51
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('finances', '0014_auto_20261019_0651'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='transaction',
+            index=models.Index(fields=['dr', 'timestamp'], name='finances_tr_dr_id_153519_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='transaction',
+            index=models.Index(fields=['cr', 'timestamp'], name='finances_tr_cr_id_0aade1_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='transaction',
+            index=models.Index(fields=['category', 'timestamp'], name='finances_tr_categor_cebf43_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='transaction',
+            index=models.Index(fields=['timestamp'], name='finances_tr_timesta_6ee6d2_idx'),
+        ),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 2.0.13 on 2026-10-18 17:55
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('finances', '0015_auto_20261019_0651'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MonthlyRollup',
+            fields=[
+                ('id', models.AutoField(primary_key=True, serialize=False)),
+                ('month', models.DateField(help_text='First day of the month')),
+                ('total', models.DecimalField(decimal_places=2, max_digits=12)),
+                ('count', models.PositiveIntegerField()),
+                ('minimum', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('maximum', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('account', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='finances.Account')),
+                ('category', models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, to='finances.Category')),
+            ],
+            options={
+                'ordering': ['month'],
+            },
+        ),
+        migrations.AddIndex(
+            model_name='monthlyrollup',
+            index=models.Index(fields=['month', 'category'], name='finances_mo_month_e44cae_idx'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='monthlyrollup',
+            unique_together={('account', 'category', 'month')},
+        ),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 2.0.13 on 2026-10-18 17:57
+
+from django.db import migrations, models
+import django.db.models.deletion
+import finances.validators
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('finances', '0016_auto_20261019_0655'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CategoryRule',
+            fields=[
+                ('id', models.AutoField(primary_key=True, serialize=False)),
+                ('priority', models.IntegerField(default=0, help_text='Rules with lower numbers are tried first')),
+                ('keyword', models.CharField(blank=True, help_text='Text the description must contain (case-insensitive)', max_length=255)),
+                ('regex', models.CharField(blank=True, help_text='Regular expression the description must contain a match of', max_length=255, validators=[finances.validators.validate_regex])),
+                ('min_amount', models.DecimalField(blank=True, decimal_places=2, max_digits=10, null=True)),
+                ('max_amount', models.DecimalField(blank=True, decimal_places=2, max_digits=10, null=True)),
+                ('hits', models.PositiveIntegerField(default=0, editable=False)),
+                ('account', models.ForeignKey(blank=True, help_text='Only apply to transactions of this account', null=True, on_delete=django.db.models.deletion.CASCADE, to='finances.Account')),
+                ('category', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='finances.Category')),
+            ],
+            options={
+                'ordering': ['priority', 'id'],
+            },
+        ),
+    ]
@@ -0,0 +1,86 @@
+# Generated by Django 2.0.13 on 2026-10-18 17:58
+
+from django.db import migrations, models
+import django.db.models.deletion
+import taggit.managers
+
+
+def move_transaction_tags(apps, schema_editor):
+    """
+    Copy transaction tags from taggit's generic TaggedItem table
+    """
+    ContentType = apps.get_model('contenttypes', 'ContentType')
+    TaggedItem = apps.get_model('taggit', 'TaggedItem')
+    TaggedTransaction = apps.get_model('finances', 'TaggedTransaction')
+    content_type = ContentType.objects.filter(app_label='finances', model='transaction').first()
+    if content_type is None:
+        return
+    items = TaggedItem.objects.filter(content_type=content_type)
+    TaggedTransaction.objects.bulk_create(
+        [TaggedTransaction(tag_id=tag_id, content_object_id=object_id)
+         for tag_id, object_id in items.values_list('tag_id', 'object_id').iterator()],
+        batch_size=500)
+    items.delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('contenttypes', '0002_remove_content_type_name'),
+        ('taggit', '0003_taggeditem_add_unique_index'),
+        ('finances', '0017_categoryrule'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TaggedCategory',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='TaggedTransaction',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+            ],
+        ),
+        migrations.AlterField(
+            model_name='category',
+            name='tags',
+            field=taggit.managers.TaggableManager(blank=True, help_text='A comma-separated list of tags.', through='finances.TaggedCategory', to='taggit.Tag', verbose_name='Tags'),
+        ),
+        migrations.AlterField(
+            model_name='transaction',
+            name='tags',
+            field=taggit.managers.TaggableManager(blank=True, help_text='A comma-separated list of tags.', through='finances.TaggedTransaction', to='taggit.Tag', verbose_name='Tags'),
+        ),
+        migrations.AddField(
+            model_name='taggedtransaction',
+            name='content_object',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='tagged_items', to='finances.Transaction'),
+        ),
+        migrations.AddField(
+            model_name='taggedtransaction',
+            name='tag',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='finances_taggedtransaction_items', to='taggit.Tag'),
+        ),
+        migrations.AddField(
+            model_name='taggedcategory',
+            name='content_object',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='tagged_items', to='finances.Category'),
+        ),
+        migrations.AddField(
+            model_name='taggedcategory',
+            name='tag',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='finances_taggedcategory_items', to='taggit.Tag'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='taggedtransaction',
+            unique_together={('tag', 'content_object')},
+        ),
+        migrations.AlterUniqueTogether(
+            name='taggedcategory',
+            unique_together={('tag', 'content_object')},
+        ),
+        migrations.RunPython(move_transaction_tags, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 2.0.13 on 2026-10-18 18:00
+
+import django.core.validators
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('finances', '0018_auto_20261019_0658'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='account',
+            name='transaction_file',
+            field=models.FileField(blank=True, null=True, upload_to='', validators=[django.core.validators.FileExtensionValidator(['csv', 'ofx', 'qif'], 'Upload a CSV, OFX or QIF statement')]),
+        ),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 2.0.13 on 2026-10-18 18:24
+
+from django.db import migrations, models
+
+from finances.search import create_index, drop_index
+
+
+def create_search_index(apps, schema_editor):
+    create_index(schema_editor.connection)
+
+
+def drop_search_index(apps, schema_editor):
+    drop_index(schema_editor.connection)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('finances', '0020_transaction_search'),
+    ]
+
+    # SQLite adds the column by rebuilding the table, which drops the search
+    # index's triggers, so the index is rebuilt around it
+    operations = [
+        migrations.RunPython(drop_search_index, create_search_index),
+        migrations.AddField(
+            model_name='transaction',
+            name='transfer_fingerprint',
+            field=models.CharField(blank=True, editable=False, help_text="Identity of the other account's statement row, for a matched transfer", max_length=64, null=True, unique=True),
+        ),
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
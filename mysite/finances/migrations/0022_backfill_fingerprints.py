@@ -0,0 +1,60 @@
+import hashlib
+from collections import defaultdict
+from datetime import datetime, time
+from decimal import Decimal
+
+from django.db import migrations, models
+from django.db.models import Case, Value, When
+from django.utils import timezone
+
+CENTS = Decimal('0.01')
+CHUNK_SIZE = 500
+
+
+def fingerprint(account_name, posted, amount, desc, occurrence):
+    """
+    finances.models.transaction_fingerprint as of this migration
+    """
+    key = "%s|%s|%s|%s|%d" % (account_name, posted.isoformat(), amount, desc, occurrence)
+    return hashlib.sha256(key.encode('utf-8')).hexdigest()
+
+
+def backfill_fingerprints(apps, schema_editor):
+    """
+    Fingerprint the transactions imported before fingerprints existed, so
+    re-importing their statements does not add them again
+    Rows were imported at local midnight of the statement date, one-sided,
+    and in statement order, which gives their occurrence
+    """
+    Transaction = apps.get_model('finances', 'Transaction')
+    rows = (Transaction.objects.using(schema_editor.connection.alias)
+            .filter(fingerprint__isnull=True)
+            .filter(models.Q(dr__isnull=True, cr__isnull=False) | models.Q(dr__isnull=False, cr__isnull=True))
+            .order_by('id')
+            .values_list('id', 'dr', 'cr', 'timestamp', 'amount', 'description'))
+    seen = defaultdict(int)
+    fingerprints = []
+    for id, dr, cr, timestamp, amount, desc in rows.iterator():
+        account_name = dr or cr
+        local = timezone.localtime(timestamp) if timezone.is_aware(timestamp) else timestamp
+        posted = timezone.make_aware(datetime.combine(local.date(), time()), is_dst=False)
+        amount = Decimal(amount).quantize(CENTS)
+        key = (account_name, posted, amount, desc)
+        fingerprints.append((id, fingerprint(account_name, posted, amount, desc, seen[key])))
+        seen[key] += 1
+    for i in range(0, len(fingerprints), CHUNK_SIZE):
+        chunk = fingerprints[i:i + CHUNK_SIZE]
+        Transaction.objects.using(schema_editor.connection.alias).filter(id__in=[id for id, _ in chunk]).update(
+            fingerprint=Case(*[When(id=id, then=Value(value)) for id, value in chunk],
+                             output_field=models.CharField()))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('finances', '0021_transaction_transfer_fingerprint'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_fingerprints, migrations.RunPython.noop),
+    ]
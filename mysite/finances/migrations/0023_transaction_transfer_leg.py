@@ -0,0 +1,36 @@
+# Generated by Django 2.0.13 on 2026-10-18 18:52
+
+from django.db import migrations, models
+
+from finances.search import create_index, drop_index
+
+
+def create_search_index(apps, schema_editor):
+    create_index(schema_editor.connection)
+
+
+def drop_search_index(apps, schema_editor):
+    drop_index(schema_editor.connection)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('finances', '0022_backfill_fingerprints'),
+    ]
+
+    # As in 0021, SQLite's table rebuild drops the search index's triggers
+    operations = [
+        migrations.RunPython(drop_search_index, create_search_index),
+        migrations.AddField(
+            model_name='transaction',
+            name='transfer_description',
+            field=models.CharField(blank=True, editable=False, help_text="Description on the other account's statement, for a matched transfer", max_length=255, null=True),
+        ),
+        migrations.AddField(
+            model_name='transaction',
+            name='transfer_timestamp',
+            field=models.DateTimeField(blank=True, editable=False, help_text="Time on the other account's statement, for a matched transfer", null=True),
+        ),
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -1,28 +1,78 @@
-from django.db import models
+from django.db import models, transaction
+from django.db.models import prefetch_related_objects
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.core.files.storage import default_storage
 from django.contrib.auth.models import User
 from django.contrib.contenttypes.models import ContentType
-from django_pandas.io import read_frame
-from django_pandas.managers import DataFrameManager
 from taggit.managers import TaggableManager
-from .validators import validate_csv
-import csv
-from django.core.exceptions import ValidationError
-from django.utils.translation import gettext_lazy as _
-from dateutil.parser import parse
+from taggit.models import Tag, TaggedItemBase
+from .validators import validate_statement, validate_statement_format, validate_regex
+from .rules import CategoryMatcher
+from .transfers import pair_transfers
+from .parsers import decode_lines, read_statement
+from .cache import ACCOUNTS, bump, invalidate, invalidate_all
+from .snapshot import Columns, append_to_snapshot, discard_all_snapshots, discard_snapshot, has_snapshot
 from datetime import datetime, timedelta
-from django.db.models import Q
+from django.db.models import Q, F, Case, When, Value, Sum, Func, Count, Min, Max
+from django.db.models.functions import TruncMonth
 from django.utils import timezone
-from django.db.models.signals import post_delete
+from django.urls import reverse
+from django.db.models.signals import pre_save, post_save, pre_delete, post_delete
 from django.dispatch import receiver
+import logging
 import os
+import time
+import hashlib
+from collections import Counter, defaultdict
+from decimal import Decimal
+
+# Number of rows written per INSERT when importing statements
+IMPORT_BATCH_SIZE = getattr(settings, 'FINANCES_IMPORT_BATCH_SIZE', 1000)
+# Whether uploaded statements are kept in storage and imported by the worker,
+# or imported straight from the upload and discarded
+KEEP_STATEMENTS = getattr(settings, 'FINANCES_KEEP_STATEMENTS', True)
+# Import jobs running longer than this are taken to have lost their worker
+IMPORT_JOB_TIMEOUT = timedelta(seconds=getattr(settings, 'FINANCES_IMPORT_JOB_TIMEOUT', 3600))
+# Values per IN (...) lookup, kept under SQLite's 999 variable limit
+IN_LOOKUP_SIZE = 500
+CENTS = Decimal('0.01')
+# Largest time between the two legs of a transfer imported from both accounts
+TRANSFER_WINDOW = timedelta(days=getattr(settings, 'FINANCES_TRANSFER_WINDOW_DAYS', 3))
+
+import_logger = logging.getLogger('finances.import')
 
 # Create your models here.
+class TaggedQuerySet(models.QuerySet):
+    """
+    QuerySet for models tagged through a foreign-key TaggedItemBase model
+    """
+    def with_tags(self):
+        return self.prefetch_related('tags')
+
+    def tagged(self, *names):
+        """
+        Objects carrying any of the named tags
+        Resolved from the (tag, object) index of the through table rather than
+        a join from every object to its tags
+        """
+        through = self.model._meta.get_field('tags').through
+        return self.filter(pk__in=through.objects.filter(tag__name__in=names).values('content_object'))
+
+    def add_tags(self, *names):
+        return bulk_add_tags(self, names)
+
+    def remove_tags(self, *names):
+        return bulk_remove_tags(self, names)
+
 class Category(models.Model):
     """
     Category of account or transaction
     """
     name = models.CharField(max_length=255, help_text="Category of account or transaction", primary_key=True)
-    tags = TaggableManager()
+    tags = TaggableManager(through='TaggedCategory', blank=True)
+
+    objects = TaggedQuerySet.as_manager()
 
     class Meta:
         ordering = ["name"]
@@ -41,7 +91,9 @@ class Account(models.Model):
     description = models.CharField(max_length=255, help_text="Enter a description (e.g. KiwiBank Everyday)", blank=True, null=True)
     owner = models.ForeignKey(User, on_delete=models.SET_NULL, blank=True, null=True)
     current_balance = models.DecimalField(max_digits=10, decimal_places=2, blank=True, null=True)
-    transaction_file = models.FileField(blank=True, null=True, validators=[validate_csv])
+    transaction_file = models.FileField(blank=True, null=True, validators=[validate_statement])
+    transaction_file_hash = models.CharField(max_length=64, blank=True, null=True, editable=False,
+                                             help_text="SHA-256 of the last imported statement")
 
     class Meta:
         ordering = ["name"]
@@ -49,8 +101,80 @@ class Account(models.Model):
     def __str__(self):
         return self.name
 
-    def process_transactions(self):
-        qs = self.transaction_set.all().order_by('timestamp')
+    def get_absolute_url(self):
+        return reverse('account-detail', args=[self.name])
+
+    def transactions(self):
+        return Transaction.objects.filter(Q(dr=self) | Q(cr=self))
+
+    def ledger(self, before=None, limit=50):
+        """
+        Page of this account's transactions, newest first, ending before the
+        (timestamp, id) key given
+        Each side is read as a bounded range of its (account, timestamp) index
+        and the two are merged, so cost does not grow with the page's depth
+        Returns (transactions, key of the last transaction or None if no more)
+        """
+        candidates = {}
+        for side in ('dr', 'cr'):
+            qs = Transaction.objects.filter(**{side: self})
+            if before is not None:
+                timestamp, pk = before
+                qs = qs.filter(timestamp__lte=timestamp).exclude(timestamp=timestamp, id__gte=pk)
+            qs = qs.select_related('dr', 'cr', 'category').order_by('-timestamp', '-id')
+            candidates.update((t.id, t) for t in qs[:limit + 1])
+        transactions = sorted(candidates.values(), key=lambda t: (t.timestamp, t.id), reverse=True)
+        page = transactions[:limit]
+        prefetch_related_objects(page, 'tags')
+        next_key = (page[-1].timestamp, page[-1].id) if len(transactions) > limit else None
+        return page, next_key
+
+    def signed_amount(self):
+        """
+        Expression for a transaction's effect on this account: credits add, debits subtract
+        """
+        return Case(
+            When(cr=self, then=Func(F('amount'), function='ABS')),
+            default=Func(F('amount'), function='ABS') * -1,
+            output_field=models.DecimalField(max_digits=10, decimal_places=2))
+
+    def process_transactions(self, since=None):
+        """
+        Rebuild the balance history from since (or the beginning) onward
+        Earlier Balance rows are kept and the running total resumes from them
+        """
+        with transaction.atomic():
+            history = self.balance_set.all()
+            transactions = self.transactions()
+            if since is not None:
+                history = history.filter(timestamp__gte=since)
+                transactions = transactions.filter(timestamp__gte=since)
+                balance = self.balance_at(since, inclusive=False)
+            else:
+                balance = Decimal(0)
+            history.delete()
+            changes = (transactions
+                .values('timestamp')
+                .annotate(change=Sum(self.signed_amount()))
+                .order_by('timestamp'))
+            batch = []
+            for row in changes.iterator():
+                balance += row['change']
+                batch.append(Balance(account=self, timestamp=row['timestamp'], amount=balance))
+                if len(batch) >= IMPORT_BATCH_SIZE:
+                    Balance.objects.bulk_create(batch)
+                    batch = []
+            Balance.objects.bulk_create(batch)
+            Account.objects.filter(pk=self.pk).update(current_balance=balance)
+            self.current_balance = balance
+
+    def balance_at(self, when, inclusive=True):
+        """
+        Balance after all transactions up to when
+        """
+        history = self.balance_set.filter(**{'timestamp__lte' if inclusive else 'timestamp__lt': when})
+        balance = history.order_by('-timestamp').values_list('amount', flat=True).first()
+        return balance if balance is not None else Decimal(0)
 
     def get_balance_dataframe(self):
         qs = self.balance_set.all()
@@ -58,11 +182,45 @@ class Account(models.Model):
                 values='amount')
         return ts
 
+    def clean(self):
+        if self.transaction_file and not self.transaction_file._committed:
+            try:
+                validate_statement_format(self.transaction_file)
+            except ValidationError as e:
+                raise ValidationError({'transaction_file': e.messages})
+
     def save(self, *args, **kwargs):
+        previous_file, self.transaction_file_hash = Account.objects.filter(pk=self.pk).values_list(
+            'transaction_file', 'transaction_file_hash').first() or (None, None)
+        upload = None
+        if self.transaction_file and not self.transaction_file._committed and not KEEP_STATEMENTS:
+            # Import from the upload's chunks instead of storing it
+            upload = self.transaction_file
+            self.transaction_file = previous_file
+        if upload is not None:
+            # A statement that fails to import leaves the account unsaved too
+            with transaction.atomic():
+                super(Account, self).save(*args, **kwargs)
+                process_statement(upload.chunks(), self.name, label=upload.name,
+                                  content_hash=chunks_hash(upload.chunks()))
+            return
         super(Account, self).save(*args, **kwargs)
-        print(self.transaction_file)
-        if self.transaction_file:
-            process_account_csv(self.transaction_file.url, self.name)
+        if self.transaction_file and self.transaction_file.name != previous_file:
+            self.queue_import()
+
+    def delete(self, *args, **kwargs):
+        # Detach transactions in two UPDATEs rather than letting the collector
+        # fetch and null them in batches; orphans are removed by post_delete
+        with transaction.atomic():
+            Transaction.objects.filter(dr=self).update(dr=None)
+            Transaction.objects.filter(cr=self).update(cr=None)
+            return super(Account, self).delete(*args, **kwargs)
+
+    def queue_import(self):
+        """
+        Queue the current transaction file for the import worker
+        """
+        return ImportJob.objects.create(account=self, statement=self.transaction_file.name)
 
 
 class Transaction(models.Model):
@@ -77,21 +235,75 @@ class Transaction(models.Model):
     description = models.CharField(max_length=255)
     timestamp = models.DateTimeField()
     category = models.ForeignKey(Category, related_name="category", on_delete=models.SET_NULL, null=True)
-    tags = TaggableManager()
+    fingerprint = models.CharField(max_length=64, unique=True, blank=True, null=True, editable=False,
+                                   help_text="Identity of the statement row this was imported from")
+    transfer_fingerprint = models.CharField(max_length=64, unique=True, blank=True, null=True, editable=False,
+                                            help_text="Identity of the other account's statement row, for a matched transfer")
+    transfer_description = models.CharField(max_length=255, blank=True, null=True, editable=False,
+                                            help_text="Description on the other account's statement, for a matched transfer")
+    transfer_timestamp = models.DateTimeField(blank=True, null=True, editable=False,
+                                              help_text="Time on the other account's statement, for a matched transfer")
+    tags = TaggableManager(through='TaggedTransaction', blank=True)
+
+    objects = TaggedQuerySet.as_manager()
 
     class Meta:
         ordering = ["timestamp"]
+        indexes = [
+            models.Index(fields=["dr", "timestamp"]),
+            models.Index(fields=["cr", "timestamp"]),
+            models.Index(fields=["category", "timestamp"]),
+            models.Index(fields=["timestamp"]),
+        ]
 
     def __str__(self):
         local_timestamp = timezone.localtime(self.timestamp)
         trans_str = "%s: " % local_timestamp.strftime("%B %d, %Y")
-        if self.cr:
-            trans_str += str(self.cr) + " \u2192 "
+        # Account names are their primary keys, so no need to load the accounts
+        if self.cr_id:
+            trans_str += self.cr_id + " \u2192 "
         trans_str += "$%.2f" % abs(self.amount)
-        if self.dr:
-            trans_str += " \u2192 " + str(self.dr)
+        if self.dr_id:
+            trans_str += " \u2192 " + self.dr_id
         return trans_str
 
+class TaggedCategory(TaggedItemBase):
+    """
+    Tag applied to a category
+    Category keys are names, which taggit's generic integer object_id cannot hold
+    """
+    content_object = models.ForeignKey(Category, on_delete=models.CASCADE, related_name="tagged_items")
+
+    class Meta:
+        unique_together = ("tag", "content_object")
+
+class TaggedTransaction(TaggedItemBase):
+    """
+    Tag applied to a transaction, through a real foreign key so tag lookups
+    and bulk writes use plain indexes instead of a generic relation
+    """
+    content_object = models.ForeignKey(Transaction, on_delete=models.CASCADE, related_name="tagged_items")
+
+    class Meta:
+        unique_together = ("tag", "content_object")
+
+class DataFrameQuerySet(models.QuerySet):
+    """
+    django_pandas' DataFrameQuerySet methods, importing pandas on first use
+    rather than in every process that loads the models
+    """
+    def to_dataframe(self, *args, **kwargs):
+        from django_pandas.managers import DataFrameQuerySet
+        return DataFrameQuerySet.to_dataframe(self, *args, **kwargs)
+
+    def to_timeseries(self, *args, **kwargs):
+        from django_pandas.managers import DataFrameQuerySet
+        return DataFrameQuerySet.to_timeseries(self, *args, **kwargs)
+
+    def to_pivot_table(self, *args, **kwargs):
+        from django_pandas.managers import DataFrameQuerySet
+        return DataFrameQuerySet.to_pivot_table(self, *args, **kwargs)
+
 class Balance(models.Model):
     """
     Model representing an account's balance history at a certain time
@@ -101,52 +313,744 @@ class Balance(models.Model):
     timestamp = models.DateTimeField()
     amount = models.DecimalField(max_digits=10, decimal_places=2, default=0)
 
-    objects = DataFrameManager()
+    objects = DataFrameQuerySet.as_manager()
+
+    class Meta:
+        ordering = ["timestamp"]
+        unique_together = ("account", "timestamp")
+
+def month_start(timestamp):
+    """
+    Start of the local calendar month containing timestamp
+    """
+    local = timezone.localtime(timestamp)
+    return timezone.make_aware(datetime(local.year, local.month, 1))
+
+def next_month(timestamp):
+    """
+    Start of the local calendar month after the one containing timestamp
+    """
+    local = timezone.localtime(timestamp)
+    year, month = divmod(local.year * 12 + local.month, 12)
+    return timezone.make_aware(datetime(year, month + 1, 1))
+
+class MonthlyRollupManager(models.Manager):
 
-def process_account_csv(url, name):
-    print("Processing", url)
-    print(url)
-    with open(url) as file:
-        csvreader = csv.reader(file)
-        csvlist = list(csvreader)
-        if not csvlist[0][0] or any(csvlist[0][1:]):
-            raise ValidationError(_("Uploaded CSV was not in 'KiwiBank Basic' format."))
+    def aggregate_transactions(self, account, since=None, until=None):
+        """
+        Per (month, category) totals of an account's transactions, from the Transaction table
+        """
+        transactions = account.transactions()
+        if since is not None:
+            transactions = transactions.filter(timestamp__gte=month_start(since))
+        if until is not None:
+            transactions = transactions.filter(timestamp__lt=next_month(until))
+        effect = account.signed_amount()
+        rows = (transactions
+            .annotate(month=TruncMonth('timestamp'))
+            .values('month', 'category')
+            .annotate(total=Sum(effect), count=Count('id'), minimum=Min(effect), maximum=Max(effect))
+            .order_by())
+        for row in rows.iterator():
+            # Truncated in local time; a DateField output would truncate in UTC
+            row['month'] = timezone.localtime(row['month']).date()
+            yield row
+
+    def refresh(self, account, since=None, until=None):
+        """
+        Recompute an account's rollups for the months from since to until
+        Both default to the whole history
+        """
+        with transaction.atomic():
+            stale = self.filter(account=account)
+            if since is not None:
+                stale = stale.filter(month__gte=month_start(since).date())
+            if until is not None:
+                stale = stale.filter(month__lt=next_month(until).date())
+            stale.delete()
+            self.bulk_create(
+                [MonthlyRollup(account=account, category_id=row['category'], month=row['month'],
+                               total=row['total'], count=row['count'],
+                               minimum=row['minimum'], maximum=row['maximum'])
+                 for row in self.aggregate_transactions(account, since, until)],
+                batch_size=IMPORT_BATCH_SIZE)
+
+    def refresh_positions(self, positions):
+        """
+        Recompute rollups for the (timestamp, account name) pairs given
+        """
+        spans = {}
+        for timestamp, name in positions:
+            if name is not None:
+                earliest, latest = spans.get(name, (timestamp, timestamp))
+                spans[name] = (min(earliest, timestamp), max(latest, timestamp))
+        for account in Account.objects.filter(pk__in=spans):
+            self.refresh(account, *spans[account.pk])
+
+    def inconsistencies(self, account):
+        """
+        Rollup rows of an account that differ from a full aggregate of its transactions
+        Returns a list of (month, category, stored, expected) tuples
+        """
+        fields = ('total', 'count', 'minimum', 'maximum')
+        stored = {(r['month'], r['category']): tuple(r[f] for f in fields)
+                  for r in self.filter(account=account).values('month', 'category', *fields)}
+        expected = {(r['month'], r['category']): tuple(r[f] for f in fields)
+                    for r in self.aggregate_transactions(account)}
+        return [key + (stored.get(key), expected.get(key))
+                for key in sorted(set(stored) | set(expected), key=lambda k: (k[0], k[1] or ''))
+                if stored.get(key) != expected.get(key)]
+
+    def report(self, accounts=None, since=None, until=None):
+        """
+        Spending by month and category, read only from the rollup table
+        """
+        rollups = self.all()
+        if accounts is not None:
+            rollups = rollups.filter(account__in=accounts)
+        if since is not None:
+            rollups = rollups.filter(month__gte=since)
+        if until is not None:
+            rollups = rollups.filter(month__lte=until)
+        return (rollups
+            .values('month', 'category')
+            .annotate(total=Sum('total'), count=Sum('count'), minimum=Min('minimum'), maximum=Max('maximum'))
+            .order_by('month', 'category'))
+
+class MonthlyRollup(models.Model):
+    """
+    Model representing the totals of an account's transactions in one
+    category over one calendar month
+    Kept up to date by the importer and by transaction and category changes
+    """
+    id = models.AutoField(primary_key=True)
+    account = models.ForeignKey(Account, on_delete=models.CASCADE)
+    category = models.ForeignKey(Category, on_delete=models.CASCADE, null=True)
+    month = models.DateField(help_text="First day of the month")
+    total = models.DecimalField(max_digits=12, decimal_places=2)
+    count = models.PositiveIntegerField()
+    minimum = models.DecimalField(max_digits=10, decimal_places=2)
+    maximum = models.DecimalField(max_digits=10, decimal_places=2)
+
+    objects = MonthlyRollupManager()
+
+    class Meta:
+        ordering = ["month"]
+        unique_together = ("account", "category", "month")
+        indexes = [
+            models.Index(fields=["month", "category"]),
+        ]
+
+    def __str__(self):
+        return "%s %s %s: %s" % (self.account_id, self.month.strftime("%Y-%m"), self.category_id, self.total)
+
+class CategoryRuleManager(models.Manager):
+
+    def matcher(self):
+        """
+        All rules compiled into a CategoryMatcher
+        """
+        return CategoryMatcher(self.order_by('priority', 'id'))
+
+    def record_hits(self, hits):
+        """
+        Add to the hit counters from a {rule id: count} mapping
+        """
+        for pk, count in hits.items():
+            self.filter(pk=pk).update(hits=F('hits') + count)
+
+class CategoryRule(models.Model):
+    """
+    Model representing a rule that assigns a category to transactions
+    Rules are tried in priority order; the first whose conditions all hold wins
+    """
+    id = models.AutoField(primary_key=True)
+    category = models.ForeignKey(Category, on_delete=models.CASCADE)
+    priority = models.IntegerField(default=0, help_text="Rules with lower numbers are tried first")
+    keyword = models.CharField(max_length=255, blank=True,
+                               help_text="Text the description must contain (case-insensitive)")
+    regex = models.CharField(max_length=255, blank=True, validators=[validate_regex],
+                             help_text="Regular expression the description must contain a match of")
+    min_amount = models.DecimalField(max_digits=10, decimal_places=2, blank=True, null=True)
+    max_amount = models.DecimalField(max_digits=10, decimal_places=2, blank=True, null=True)
+    account = models.ForeignKey(Account, on_delete=models.CASCADE, blank=True, null=True,
+                                help_text="Only apply to transactions of this account")
+    hits = models.PositiveIntegerField(default=0, editable=False)
+
+    objects = CategoryRuleManager()
+
+    class Meta:
+        ordering = ["priority", "id"]
+
+    def __str__(self):
+        conditions = [condition for condition in (self.keyword, self.regex and "/%s/" % self.regex) if condition]
+        return "%s \u2192 %s" % (" and ".join(conditions) or "any", self.category_id)
+
+class ImportJob(models.Model):
+    """
+    Model representing a queued statement import
+    Picked up by the import_worker management command
+    """
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUS_CHOICES = (
+        (QUEUED, 'Queued'),
+        (RUNNING, 'Running'),
+        (DONE, 'Done'),
+        (FAILED, 'Failed'),
+    )
+
+    id = models.AutoField(primary_key=True)
+    account = models.ForeignKey(Account, on_delete=models.CASCADE)
+    statement = models.CharField(max_length=255, help_text="Storage name of the statement file")
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=QUEUED, db_index=True)
+    created = models.DateTimeField(auto_now_add=True)
+    started = models.DateTimeField(blank=True, null=True)
+    finished = models.DateTimeField(blank=True, null=True)
+    rows_created = models.PositiveIntegerField(default=0)
+    rows_per_sec = models.FloatField(blank=True, null=True)
+    error = models.TextField(blank=True)
+
+    class Meta:
+        ordering = ["-created"]
+
+    def __str__(self):
+        return "%s: %s (%s)" % (self.account_id, self.statement, self.status)
+
+    @classmethod
+    def claim_next(cls):
+        """
+        Atomically mark the oldest queued job as running and return it
+        Returns None if the queue is empty
+        """
+        while True:
+            job = cls.objects.filter(status=cls.QUEUED).order_by('created', 'id').first()
+            if job is None:
+                return None
+            now = timezone.now()
+            if cls.objects.filter(pk=job.pk, status=cls.QUEUED).update(status=cls.RUNNING, started=now):
+                job.status = cls.RUNNING
+                job.started = now
+                return job
+
+    @classmethod
+    def requeue_stale(cls, timeout=None):
+        """
+        Queue again the jobs left running by a worker that died
+        An import is one database transaction, so a lost job wrote nothing
+        Returns the number of jobs queued again
+        """
+        started_before = timezone.now() - (timeout or IMPORT_JOB_TIMEOUT)
+        return cls.objects.filter(status=cls.RUNNING, started__lt=started_before).update(status=cls.QUEUED)
+
+    def run(self):
+        """
+        Import the statement and record the outcome on the job
+        """
+        start = time.perf_counter()
+        try:
+            with default_storage.open(self.statement, 'rb') as file:
+                # Hashed first, so an unchanged statement is not parsed at all
+                content_hash = chunks_hash(file.chunks())
+                self.rows_created = process_statement(file.chunks(), self.account_id, label=self.statement,
+                                                      content_hash=content_hash)
+        except Exception as e:
+            self.status = self.FAILED
+            self.error = "%s: %s" % (type(e).__name__, e)
         else:
-            #acc_number = csvlist[0][0]  # now ignores account number
-            account = Account.objects.get(name=name)
-            # print("Deleting old transactions...")
-            # print("No. transactions: ", Transaction.objects.all().count())
-            # Transaction.objects.filter(Q(cr=account) or Q(dr=account)).delete()
-            # Transaction.objects.all().delete()
-            # print("No. transactions: ", Transaction.objects.all().count())
-            for row in csvlist[1:]:
-                timestamp = timezone.make_aware(parse(row[0]))
-                print(row[0], ' -> ', timestamp)
-                desc = row[1].split(";")[0].strip()
-                if "-" in desc and ":" in desc:
-                    desc, clocktime = desc.rsplit("-", 1)
-                    clocktime = clocktime.strip(" ")
-                    if ":" in clocktime:
-                        c = datetime.strptime(clocktime, "%H:%M")
-                        delta = timedelta(hours=c.hour, minutes=c.minute)
-                        # timestamp += delta
-                amount = float(row[3])
-                if amount <= 0:
-                    dr = account
-                    cr = None
-                else:
-                    cr = account
-                    dr = None
-                t = Transaction.objects.create(dr=dr, cr=cr, amount=amount, description=desc, timestamp=timestamp)
+            self.status = self.DONE
+            elapsed = time.perf_counter() - start
+            self.rows_per_sec = self.rows_created / elapsed if elapsed else None
+        self.finished = timezone.now()
+        self.save()
+
+def chunks_hash(chunks):
+    """
+    SHA-256 of an iterable of byte chunks
+    """
+    digest = hashlib.sha256()
+    for chunk in chunks:
+        digest.update(chunk)
+    return digest.hexdigest()
+
+def file_hash(path):
+    """
+    SHA-256 of a file's contents, read in chunks
+    """
+    with open(path, 'rb') as file:
+        return chunks_hash(iter(lambda: file.read(65536), b''))
+
+def transaction_fingerprint(account_name, posted, amount, desc, occurrence):
+    """
+    Stable identity of an imported statement row
+    posted is the statement date, not the more precise transaction time, so
+    rows keep their identity whatever time of day a parser extracts
+    occurrence distinguishes otherwise identical rows within one statement
+    """
+    key = "%s|%s|%s|%s|%d" % (account_name, posted.isoformat(), amount, desc, occurrence)
+    return hashlib.sha256(key.encode('utf-8')).hexdigest()
+
+def _create_new(batch):
+    """
+    bulk_create the transactions in batch whose fingerprint is not already stored,
+    either as a transaction or as the merged leg of a transfer
+    Returns the inserted transactions
+    """
+    fingerprints = [t.fingerprint for t in batch]
+    existing = set()
+    for i in range(0, len(fingerprints), IN_LOOKUP_SIZE):
+        chunk = fingerprints[i:i + IN_LOOKUP_SIZE]
+        existing.update(Transaction.objects.filter(fingerprint__in=chunk).values_list('fingerprint', flat=True))
+        existing.update(Transaction.objects.filter(transfer_fingerprint__in=chunk)
+                        .values_list('transfer_fingerprint', flat=True))
+    new = [t for t in batch if t.fingerprint not in existing]
+    Transaction.objects.bulk_create(new)
+    return new
+
+def _flush(batch, name, hits, columns):
+    """
+    Write a batch of transactions imported into the account name, counting
+    the rule hits of the new ones and gathering their snapshot rows unless
+    columns is None
+    Returns the new transactions
+    """
+    new = _create_new(batch)
+    hits.update(t.rule_id for t in new if t.rule_id)
+    if columns is not None:
+        columns.add(name, ((t.timestamp, t.amount, t.category_id, t.dr_id, t.cr_id) for t in new))
+    return new
+
+def _span(span, transactions):
+    """
+    Widen an (earliest, latest) timestamp span, or None, to cover transactions
+    """
+    timestamps = [t.timestamp for t in transactions]
+    if span is not None:
+        timestamps.extend(span)
+    return (min(timestamps), max(timestamps)) if timestamps else None
+
+def process_account_csv(path, name, batch_size=None):
+    """
+    Import a statement file into an account, unless it is identical to the
+    last one imported
+    Returns the number of transactions created
+    """
+    content_hash = file_hash(path)
+    with open(path, 'rb') as file:
+        chunks = iter(lambda: file.read(65536), b'')
+        return process_statement(chunks, name, batch_size, label=path, content_hash=content_hash)
+
+def _hashed(chunks, digest):
+    """
+    Pass byte chunks through, adding them to digest
+    """
+    for chunk in chunks:
+        digest.update(chunk)
+        yield chunk
+
+def process_statement(chunks, name, batch_size=None, label=None, content_hash=None):
+    """
+    Import a statement, in any format finances.parsers recognises, into an account
+    The statement is read once, as an iterable of byte chunks such as
+    File.chunks(), so memory use does not grow with its size
+    Given its content_hash, a statement identical to the last one imported
+    into the account is not read at all
+    Returns the number of transactions created
+    """
+    digest = None
+    if content_hash is None:
+        digest = hashlib.sha256()
+        chunks = _hashed(chunks, digest)
+    elif content_hash == Account.objects.filter(name=name).values_list('transaction_file_hash', flat=True).first():
+        import_logger.info("%s unchanged since last import", label or "Statement")
+        return 0
+    return import_rows(read_statement(decode_lines(chunks)), name, batch_size, label,
+                       content_hash=content_hash or digest.hexdigest)
+
+def import_rows(rows, name, batch_size=None, label=None, content_hash=None):
+    """
+    Import StatementRows into an account
+    content_hash is the statement's hash, or a function returning it once the
+    rows have been read
+    Rows are written with bulk_create in batches of batch_size, all inside a
+    single database transaction, and rows already imported (by fingerprint)
+    are skipped
+    Categories are assigned by the category rules as rows are read
+    The balance history is then rebuilt from the earliest new row onward and
+    the monthly rollups for the months the new rows fall in
+    Returns the number of transactions created
+    """
+    batch_size = batch_size or IMPORT_BATCH_SIZE
+    import_logger.info("Processing %s", label or "statement")
+    start = time.perf_counter()
+    account = Account.objects.get(name=name)
+    created = 0
+    span = None
+    seen = defaultdict(int)
+    matcher = CategoryRule.objects.matcher()
+    hits = Counter()
+    # Snapshot rows are only worth holding until commit for a snapshot to append to
+    columns = Columns() if has_snapshot(account.name) else None
+    with transaction.atomic():
+        batch = []
+        for timestamp, posted, desc, amount in rows:
+            if amount <= 0:
+                dr = account
+                cr = None
+            else:
+                cr = account
+                dr = None
+            occurrence = seen[posted, amount, desc]
+            seen[posted, amount, desc] += 1
+            fingerprint = transaction_fingerprint(account.name, posted, amount, desc, occurrence)
+            rule = matcher.match(desc, amount, account.name) if matcher else None
+            t = Transaction(dr=dr, cr=cr, amount=amount, description=desc, timestamp=timestamp,
+                            fingerprint=fingerprint, category_id=rule.category_id if rule else None)
+            t.rule_id = rule.id if rule else None
+            batch.append(t)
+            if len(batch) >= batch_size:
+                new = _flush(batch, account.name, hits, columns)
+                created += len(new)
+                span = _span(span, new)
+                batch = []
+        if batch:
+            new = _flush(batch, account.name, hits, columns)
+            created += len(new)
+            span = _span(span, new)
+        if columns is not None:
+            transaction.on_commit(lambda: append_to_snapshot(account.name, columns))
+        elif span is not None:
+            # A snapshot built while importing would lack the new rows
+            discard_snapshot(account.name)
+        CategoryRule.objects.record_hits(hits)
+        if callable(content_hash):
+            content_hash = content_hash()
+        Account.objects.filter(name=account.name).update(transaction_file_hash=content_hash)
+        if span is not None:
+            account.process_transactions(since=span[0])
+            MonthlyRollup.objects.refresh(account, *span)
+            invalidate(account.name)
+            transfers = match_transfers(*span)
+    elapsed = time.perf_counter() - start
+    import_logger.info("Imported %d transactions in %.2fs (%.0f rows/sec)",
+                       created, elapsed, created / elapsed if elapsed else 0)
+    if span is not None and transfers:
+        import_logger.info("Matched %d transfers", transfers)
+    return created
+
+def match_transfers(since=None, until=None, window=None):
+    """
+    Merge transfers imported from both accounts' statements into one
+    transaction debiting one account and crediting the other
+    One-sided rows from since - window to until + window are paired by
+    transfers.pair_transfers, between accounts of one owner; each
+    debit row gains the credit account and the credit row's fingerprint, so
+    re-importing either statement adds nothing, and its description and
+    time, so unmatch_transfer can restore it, and the credit row is deleted
+    Returns the number of transfers merged
+    """
+    if window is None:
+        window = TRANSFER_WINDOW
+    candidates = (Transaction.objects
+                  .filter(Q(dr__isnull=True, cr__isnull=False) | Q(dr__isnull=False, cr__isnull=True)))
+    if since is not None:
+        candidates = candidates.filter(timestamp__gte=since - window)
+    if until is not None:
+        candidates = candidates.filter(timestamp__lte=until + window)
+    candidates = candidates.order_by()
+    # Only amounts both debited and credited can pair, which is usually few of them
+    debited = set(abs(amount) for amount in
+                  candidates.filter(cr__isnull=True).values_list('amount', flat=True).distinct())
+    credited = set(abs(amount) for amount in
+                   candidates.filter(dr__isnull=True).values_list('amount', flat=True).distinct())
+    amounts = [signed for amount in debited & credited if amount for signed in (amount, -amount)]
+    rows = []
+    for i in range(0, len(amounts), IN_LOOKUP_SIZE):
+        rows.extend(candidates.filter(amount__in=amounts[i:i + IN_LOOKUP_SIZE])
+                    .values_list('id', 'timestamp', 'amount', 'dr', 'cr', 'fingerprint', 'category',
+                                 'description'))
+    owners = dict(Account.objects.filter(pk__in=set(row[3] or row[4] for row in rows))
+                  .values_list('name', 'owner'))
+    pairs = pair_transfers(rows, window, owners)
+    if not pairs:
+        return 0
+    earliest = {}
+    positions = set()
+    with transaction.atomic():
+        for i in range(0, len(pairs), IN_LOOKUP_SIZE // 2):
+            chunk = pairs[i:i + IN_LOOKUP_SIZE // 2]
+            _move_tags({credit.id: debit.id for debit, credit in chunk})
+            credits = Transaction.objects.filter(id__in=[credit.id for debit, credit in chunk])
+            credits._raw_delete(credits.db)
+            Transaction.objects.filter(id__in=[debit.id for debit, credit in chunk]).update(
+                cr=Case(*[When(id=debit.id, then=Value(credit.cr)) for debit, credit in chunk],
+                        output_field=models.CharField()),
+                transfer_fingerprint=Case(*[When(id=debit.id, then=Value(credit.fingerprint))
+                                            for debit, credit in chunk], output_field=models.CharField()),
+                transfer_description=Case(*[When(id=debit.id, then=Value(credit.description))
+                                            for debit, credit in chunk], output_field=models.CharField()),
+                transfer_timestamp=Case(*[When(id=debit.id, then=Value(credit.timestamp))
+                                          for debit, credit in chunk], output_field=models.DateTimeField()),
+                category=Case(*[When(id=debit.id, then=Value(debit.category or credit.category))
+                                for debit, credit in chunk], output_field=models.CharField()))
+            for debit, credit in chunk:
+                # Only the credited account's history moves, to the debit's time
+                when = min(debit.timestamp, credit.timestamp)
+                earliest[credit.cr] = min(earliest.get(credit.cr, when), when)
+                positions.update([(debit.timestamp, debit.dr), (debit.timestamp, credit.cr),
+                                  (credit.timestamp, credit.cr)])
+        for account in Account.objects.filter(pk__in=earliest):
+            account.process_transactions(since=earliest[account.pk])
+        MonthlyRollup.objects.refresh_positions(positions)
+        names = set(name for timestamp, name in positions)
+        invalidate(*names)
+        discard_snapshot(*names)
+    return len(pairs)
+
+def unmatch_transfer(transfer):
+    """
+    Split a transfer merged by match_transfers back into its debit row and a
+    recreated credit row, for a false match
+    Transfers merged before descriptions and times were kept get the debit's
+    Returns the credit Transaction
+    """
+    with transaction.atomic():
+        credit = Transaction(cr_id=transfer.cr_id, amount=abs(transfer.amount),
+                             description=transfer.transfer_description or transfer.description,
+                             timestamp=transfer.transfer_timestamp or transfer.timestamp,
+                             fingerprint=transfer.transfer_fingerprint, category_id=transfer.category_id)
+        transfer.cr = None
+        transfer.transfer_fingerprint = None
+        transfer.transfer_description = None
+        transfer.transfer_timestamp = None
+        transfer.save()
+        credit.save()
+    return credit
+
+def _move_tags(moves):
+    """
+    Move the tags of transactions onto others, {from id: to id}, dropping
+    tags the destination already has
+    """
+    tagged = list(TaggedTransaction.objects
+                  .filter(content_object__in=list(moves) + list(moves.values()))
+                  .values_list('id', 'tag', 'content_object'))
+    present = set((tag, pk) for id, tag, pk in tagged)
+    duplicate = [id for id, tag, pk in tagged if pk in moves and (tag, moves[pk]) in present]
+    moving = [(id, moves[pk]) for id, tag, pk in tagged if pk in moves and (tag, moves[pk]) not in present]
+    TaggedTransaction.objects.filter(id__in=duplicate).delete()
+    if moving:
+        TaggedTransaction.objects.filter(id__in=[id for id, pk in moving]).update(
+            content_object=Case(*[When(id=id, then=Value(pk)) for id, pk in moving],
+                                output_field=models.IntegerField()))
+
+def delete_orphan_transactions():
+    """
+    Delete transactions that belong to neither a debit nor a credit account
+    Runs as two set-based DELETEs (tags, then transactions) without loading rows
+    Returns the number of transactions deleted
+    """
+    orphans = Transaction.objects.filter(dr__isnull=True, cr__isnull=True)
+    with transaction.atomic():
+        TaggedTransaction.objects.filter(content_object__in=orphans).delete()
+        # _raw_delete skips the collector, which would fetch every row first
+        return orphans._raw_delete(orphans.db)
+
+def purge_accounts(accounts):
+    """
+    Delete a queryset of accounts and their transactions in a bounded number of queries
+    Transfers with an account that is kept only lose the purged side
+    Returns the number of transactions deleted
+    """
+    names = accounts.values('name')
+    with transaction.atomic():
+        Transaction.objects.filter(dr__in=names).update(dr=None)
+        Transaction.objects.filter(cr__in=names).update(cr=None)
+        deleted = delete_orphan_transactions()
+        accounts.delete()
+        invalidate_all()
+        discard_all_snapshots()
+    return deleted
 
 @receiver(post_delete, sender=Account)
 def cascade_transactions_delete(sender, instance, *args, **kwargs):
     """
-    Check all transactions and delete any orphans
+    Delete any orphaned transactions
+    """
+    delete_orphan_transactions()
+
+def recategorize(transactions, category):
+    """
+    Set the category of every transaction in a queryset with one UPDATE
+    and refresh the monthly rollups of the months touched
+    Returns the number of transactions updated
+    """
+    with transaction.atomic():
+        positions = set()
+        touched = (transactions
+            .annotate(month=TruncMonth('timestamp'))
+            .values_list('month', 'dr', 'cr')
+            .order_by()
+            .distinct())
+        for month, dr, cr in touched.iterator():
+            positions.update([(month, dr), (month, cr)])
+        updated = transactions.update(category=category)
+        MonthlyRollup.objects.refresh_positions(positions)
+        invalidate_all()
+        discard_snapshot(*set(name for month, name in positions))
+    return updated
+
+def apply_category_rules(transactions, overwrite=False, batch_size=None):
+    """
+    Run the category rules over a queryset of transactions
+    Rows are read in primary key order in batches; each batch is written as
+    one UPDATE per category, and rollups are refreshed once at the end
+    Uncategorized rows only, unless overwrite is set
+    Returns the number of transactions whose category changed
     """
-    for t in Transaction.objects.all():
-        if not t.dr and not t.cr:
-            t.delete()
+    batch_size = batch_size or IMPORT_BATCH_SIZE
+    matcher = CategoryRule.objects.matcher()
+    if not matcher:
+        return 0
+    if not overwrite:
+        transactions = transactions.filter(category__isnull=True)
+    changed = 0
+    hits = Counter()
+    spans = {}
+    last = 0
+    while True:
+        rows = list(transactions.filter(id__gt=last).order_by('id')
+                    .values_list('id', 'description', 'amount', 'dr', 'cr', 'category', 'timestamp')[:batch_size])
+        if not rows:
+            break
+        last = rows[-1][0]
+        updates = defaultdict(list)
+        for pk, desc, amount, dr_id, cr_id, category_id, timestamp in rows:
+            rule = matcher.match(desc, amount, dr_id, cr_id)
+            if rule is None:
+                continue
+            hits[rule.id] += 1
+            if rule.category_id != category_id:
+                updates[rule.category_id].append(pk)
+                for name in (dr_id, cr_id):
+                    if name is not None:
+                        earliest, latest = spans.get(name, (timestamp, timestamp))
+                        spans[name] = (min(earliest, timestamp), max(latest, timestamp))
+        with transaction.atomic():
+            for category_id, ids in updates.items():
+                for i in range(0, len(ids), IN_LOOKUP_SIZE):
+                    changed += (Transaction.objects.filter(id__in=ids[i:i + IN_LOOKUP_SIZE])
+                                .update(category_id=category_id))
+    CategoryRule.objects.record_hits(hits)
+    MonthlyRollup.objects.refresh_positions(
+        (timestamp, name) for name, span in spans.items() for timestamp in span)
+    if changed:
+        invalidate_all()
+        discard_snapshot(*spans)
+    return changed
+
+def _tags(names, create=True):
+    """
+    Tag objects for names, created if missing unless create is False
+    """
+    tags = list(Tag.objects.filter(name__in=names))
+    if create:
+        missing = set(names) - set(tag.name for tag in tags)
+        tags += [Tag.objects.create(name=name) for name in sorted(missing)]
+    return tags
+
+def bulk_add_tags(queryset, names):
+    """
+    Tag every object in a queryset of transactions or categories
+    Through rows are written with bulk_create in batches, skipping objects
+    that already carry the tag
+    Returns the number of tags applied
+    """
+    through = queryset.model._meta.get_field('tags').through
+    added = 0
+    with transaction.atomic():
+        for tag in _tags(names):
+            tagged = through.objects.filter(tag=tag).values('content_object')
+            batch = []
+            for pk in queryset.exclude(pk__in=tagged).values_list('pk', flat=True).iterator():
+                batch.append(through(tag=tag, content_object_id=pk))
+                if len(batch) >= IMPORT_BATCH_SIZE:
+                    through.objects.bulk_create(batch)
+                    added += len(batch)
+                    batch = []
+            through.objects.bulk_create(batch)
+            added += len(batch)
+        invalidate_all()
+    return added
+
+def bulk_remove_tags(queryset, names):
+    """
+    Remove the named tags from every object in a queryset with one DELETE
+    Returns the number of tags removed
+    """
+    through = queryset.model._meta.get_field('tags').through
+    removed, _ = through.objects.filter(tag__in=_tags(names, create=False),
+                                        content_object__in=queryset.values('pk')).delete()
+    invalidate_all()
+    return removed
+
+@receiver(pre_save, sender=Transaction)
+def remember_balance_position(sender, instance, *args, **kwargs):
+    """
+    Keep the stored timestamp and accounts of an edited transaction
+    """
+    instance._previous = None
+    if instance.pk:
+        instance._previous = (Transaction.objects.filter(pk=instance.pk)
+                              .values_list('timestamp', 'dr_id', 'cr_id').first())
+
+@receiver(post_save, sender=Transaction)
+@receiver(post_delete, sender=Transaction)
+def update_balances(sender, instance, *args, **kwargs):
+    """
+    Rebuild the balance history of affected accounts from the changed timestamp
+    """
+    positions = [(instance.timestamp, instance.dr_id, instance.cr_id)]
+    if getattr(instance, '_previous', None):
+        positions.append(instance._previous)
+    since = {}
+    for timestamp, dr_id, cr_id in positions:
+        for name in (dr_id, cr_id):
+            if name is not None:
+                since[name] = min(since.get(name, timestamp), timestamp)
+    for account in Account.objects.filter(pk__in=since):
+        account.process_transactions(since=since[account.pk])
+
+@receiver(post_save, sender=Transaction)
+@receiver(post_delete, sender=Transaction)
+def update_rollups(sender, instance, *args, **kwargs):
+    """
+    Recompute the monthly rollups of the old and new positions of a transaction
+    """
+    positions = [(instance.timestamp, instance.dr_id), (instance.timestamp, instance.cr_id)]
+    if getattr(instance, '_previous', None):
+        timestamp, dr_id, cr_id = instance._previous
+        positions += [(timestamp, dr_id), (timestamp, cr_id)]
+    MonthlyRollup.objects.refresh_positions(positions)
+
+@receiver(pre_delete, sender=Category)
+def remember_category_rollups(sender, instance, *args, **kwargs):
+    """
+    Note the rollups of a category before deletion cascades them away
+    """
+    instance._rollups = list(MonthlyRollup.objects.filter(category=instance)
+                             .values_list('month', 'account_id'))
+
+@receiver(post_delete, sender=Category)
+def update_category_rollups(sender, instance, *args, **kwargs):
+    """
+    Fold a deleted category's totals into the uncategorized rollups
+    """
+    MonthlyRollup.objects.refresh_positions(
+        (timezone.make_aware(datetime(month.year, month.month, 1)), name)
+        for month, name in getattr(instance, '_rollups', []))
 
 @receiver(post_delete, sender=Account)
 def delete_csv(sender, instance, *args, **kwargs):
@@ -156,3 +1060,56 @@ def delete_csv(sender, instance, *args, **kwargs):
     if instance.transaction_file:
         if os.path.isfile(instance.transaction_file.path):
             os.remove(instance.transaction_file.path)
+
+@receiver(post_save, sender=Account)
+@receiver(post_delete, sender=Account)
+def invalidate_account_pages(sender, instance, *args, **kwargs):
+    """
+    Move on the cached pages of an account and the account list
+    """
+    invalidate(instance.name)
+    bump(ACCOUNTS)
+
+@receiver(post_save, sender=Transaction)
+@receiver(post_delete, sender=Transaction)
+def invalidate_transaction_pages(sender, instance, *args, **kwargs):
+    """
+    Move on the cached pages of the accounts a transaction was or is in
+    """
+    names = [instance.dr_id, instance.cr_id]
+    if getattr(instance, '_previous', None):
+        names += instance._previous[1:]
+    invalidate(*names)
+
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+def invalidate_category_pages(sender, instance, *args, **kwargs):
+    """
+    Categories appear throughout, so move on every cached page
+    """
+    invalidate_all()
+
+@receiver(post_save, sender=Transaction)
+@receiver(post_delete, sender=Transaction)
+def discard_transaction_snapshots(sender, instance, *args, **kwargs):
+    """
+    Discard the ledger snapshots of the accounts a transaction was or is in
+    """
+    names = [instance.dr_id, instance.cr_id]
+    if getattr(instance, '_previous', None):
+        names += instance._previous[1:]
+    discard_snapshot(*set(names))
+
+@receiver(post_delete, sender=Account)
+def discard_account_snapshot(sender, instance, *args, **kwargs):
+    """
+    Discard a deleted account's snapshot and those of accounts with transfers to it
+    """
+    discard_all_snapshots()
+
+@receiver(post_delete, sender=Category)
+def discard_category_snapshots(sender, instance, *args, **kwargs):
+    """
+    Category codes are in every snapshot, so discard them all
+    """
+    discard_all_snapshots()
@@ -0,0 +1,291 @@
+"""
+Bank statement parsers
+
+Each parser recognises one export format from its first few lines and turns
+the rest into StatementRows. Parsers declare the date formats their exports
+use, so dates go through a cached strptime; dateutil is only the fallback.
+"""
+import codecs
+import csv
+import hashlib
+import re
+from collections import namedtuple
+from datetime import datetime, time
+from decimal import Decimal
+from functools import lru_cache
+from itertools import chain
+from time import perf_counter
+
+from dateutil.parser import parse as dateutil_parse
+from django.core.exceptions import ValidationError
+from django.utils import timezone
+from django.utils.translation import gettext_lazy as _
+
+CENTS = Decimal('0.01')
+
+# Lines read to recognise a statement's format
+HEAD_LINES = 5
+
+# timestamp is when the transaction happened, as precisely as the statement
+# says; posted is the (midnight) statement date, which identifies the row
+StatementRow = namedtuple('StatementRow', 'timestamp posted description amount')
+
+PARSERS = []
+
+
+def register(parser_class):
+    """
+    Add a parser to the registry; parsers registered first are tried first,
+    so formats with a more specific signature must come before looser ones
+    """
+    PARSERS.append(parser_class())
+    return parser_class
+
+
+def detect_parser(head):
+    """
+    Parser for a statement whose first lines are head
+    """
+    for parser in PARSERS:
+        if parser.detect(head):
+            return parser
+    raise ValidationError(_("Unrecognised statement format."))
+
+
+def decode_lines(chunks, encoding='utf-8-sig'):
+    """
+    Text lines, newlines included, from an iterable of byte chunks
+    Only one chunk and one partial line are held in memory at a time
+    """
+    decoder = codecs.getincrementaldecoder(encoding)()
+    pending = ''
+    for chunk in chunks:
+        pending += decoder.decode(chunk)
+        start = 0
+        end = pending.find('\n') + 1
+        while end:
+            yield pending[start:end]
+            start = end
+            end = pending.find('\n', start) + 1
+        pending = pending[start:]
+    pending += decoder.decode(b'', final=True)
+    if pending:
+        yield pending
+
+
+def read_statement(lines):
+    """
+    Lazily parse a statement from an iterable of text lines, in any registered format
+    Yields StatementRows
+    """
+    lines = iter(lines)
+    head = []
+    for line in lines:
+        head.append(line)
+        if len(head) >= HEAD_LINES:
+            break
+    parser = detect_parser(head)
+    return parser.parse(chain(head, lines))
+
+
+def parse_statement_file(path, chunk_size=65536):
+    """
+    (rows, SHA-256 hex digest) of a statement file
+    Touches neither the database nor the models, so it can run in a worker process
+    """
+    digest = hashlib.sha256()
+
+    def chunks():
+        with open(path, 'rb') as file:
+            for chunk in iter(lambda: file.read(chunk_size), b''):
+                digest.update(chunk)
+                yield chunk
+
+    rows = list(read_statement(decode_lines(chunks())))
+    return rows, digest.hexdigest()
+
+
+def timed_parse_statement_file(path):
+    """
+    (rows, SHA-256 hex digest, seconds) of a statement file, for a worker process
+    """
+    start = perf_counter()
+    rows, content_hash = parse_statement_file(path)
+    return rows, content_hash, perf_counter() - start
+
+
+class StatementParser:
+    """
+    Base class of statement parsers
+    """
+    name = None
+    date_formats = ()
+    dayfirst = True
+
+    def detect(self, head):
+        raise NotImplementedError
+
+    def parse(self, lines):
+        raise NotImplementedError
+
+    @lru_cache(maxsize=4096)
+    def parse_date(self, value):
+        """
+        Naive date of a statement date string
+        """
+        value = value.strip()
+        for date_format in self.date_formats:
+            try:
+                return datetime.strptime(value, date_format).date()
+            except ValueError:
+                pass
+        return dateutil_parse(value, dayfirst=self.dayfirst).date()
+
+    @lru_cache(maxsize=65536)
+    def make_row_times(self, value, clock=None):
+        """
+        (timestamp, posted) for a statement date string and optional local clock time
+        Cached as the same dates recur on many rows; assumes the current time zone does not change
+        """
+        day = self.parse_date(value)
+        posted = timezone.make_aware(datetime.combine(day, time()), is_dst=False)
+        if clock is None:
+            return posted, posted
+        return timezone.make_aware(datetime.combine(day, clock), is_dst=False), posted
+
+    def row(self, date, description, amount, clock=None):
+        timestamp, posted = self.make_row_times(date, clock)
+        return StatementRow(timestamp, posted, description, Decimal(amount.replace(",", "")).quantize(CENTS))
+
+
+class KiwiBankParser(StatementParser):
+    """
+    Shared handling of KiwiBank descriptions, which may end in "-HH:MM"
+    """
+    clock_suffix = re.compile(r"-\s*(\d{1,2}:\d{2})$")
+
+    def split_clock(self, desc):
+        """
+        (description, clock time or None) from a KiwiBank description
+        A description without a valid clock time suffix is kept whole
+        """
+        desc = desc.split(";")[0].strip()
+        match = self.clock_suffix.search(desc)
+        if match is None:
+            return desc, None
+        try:
+            clock = datetime.strptime(match.group(1), "%H:%M").time()
+        except ValueError:
+            return desc, None
+        return desc[:match.start()], clock
+
+
+@register
+class OFXParser(StatementParser):
+    """
+    OFX 1.x (SGML) and 2.x (XML) statements
+    Fields are read line by line from <STMTTRN> blocks
+    """
+    name = "OFX"
+    date_formats = ("%Y%m%d",)
+    field = re.compile(r"<(/?)(\w+)>([^<\r\n]*)")
+
+    def detect(self, head):
+        text = "".join(head).upper()
+        return "OFXHEADER" in text or "<OFX>" in text
+
+    def parse(self, lines):
+        record = None
+        for line in lines:
+            for closing, tag, value in self.field.findall(line):
+                tag = tag.upper()
+                if tag == "STMTTRN":
+                    if closing and record is not None:
+                        yield self.record_row(record)
+                        record = None
+                    elif not closing:
+                        record = {}
+                elif record is not None and not closing and value.strip():
+                    record[tag] = value.strip()
+
+    def record_row(self, record):
+        posted = record["DTPOSTED"]
+        clock = None
+        if len(posted) >= 14 and posted[8:14].isdigit():
+            clock = time(int(posted[8:10]), int(posted[10:12]), int(posted[12:14]))
+        desc = record.get("NAME") or record.get("MEMO", "")
+        return self.row(posted[:8], desc, record["TRNAMT"], clock)
+
+
+@register
+class QIFParser(StatementParser):
+    """
+    Quicken Interchange Format bank statements
+    """
+    name = "QIF"
+    date_formats = ("%d/%m/%Y", "%d/%m/%y")
+
+    def detect(self, head):
+        return bool(head) and head[0].lstrip("\ufeff").startswith(("!Type:", "!Account"))
+
+    def parse(self, lines):
+        record = {}
+        for line in lines:
+            line = line.rstrip("\r\n")
+            if not line or line.startswith("!"):
+                continue
+            if line.startswith("^"):
+                if "D" in record and "T" in record:
+                    date = record["D"].replace("'", "/").replace(" ", "")
+                    yield self.row(date, record.get("P") or record.get("M", ""), record["T"])
+                record = {}
+            else:
+                record.setdefault(line[0], line[1:].strip())
+
+
+@register
+class KiwiBankExtendedParser(KiwiBankParser):
+    """
+    KiwiBank 'Extended' CSV: a header row naming the columns
+    """
+    name = "KiwiBank Extended"
+    date_formats = ("%d-%m-%Y", "%d %b %Y")
+
+    def detect(self, head):
+        return bool(head) and head[0].lower().startswith("account number,date,")
+
+    def parse(self, lines):
+        csvreader = csv.reader(lines)
+        header = next(csvreader)
+        date_col = header.index("Date")
+        desc_col = header.index("Memo/Description")
+        amount_col = header.index("Amount")
+        for row in csvreader:
+            if not row:
+                continue
+            desc, clock = self.split_clock(row[desc_col])
+            yield self.row(row[date_col], desc, row[amount_col], clock)
+
+
+@register
+class KiwiBankBasicParser(KiwiBankParser):
+    """
+    KiwiBank 'Basic' CSV: an account number line, then date, description, -, amount, balance
+    """
+    name = "KiwiBank Basic"
+    date_formats = ("%d %b %Y",)
+
+    def detect(self, head):
+        if not head:
+            return False
+        header = next(csv.reader(head[:1]), [])
+        return bool(header) and bool(header[0]) and not any(header[1:])
+
+    def parse(self, lines):
+        csvreader = csv.reader(lines)
+        next(csvreader)  # account number, now ignored
+        for row in csvreader:
+            if not row:
+                continue
+            desc, clock = self.split_clock(row[1])
+            yield self.row(row[0], desc, row[3], clock)
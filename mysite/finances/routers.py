@@ -0,0 +1,68 @@
+"""
+Database routing and SQLite connection set-up
+
+Reads made inside reporting() go to the 'reports' database when one is
+configured: a second connection to the same SQLite file, which in WAL mode
+is never blocked by an import, or a replica refreshed by the
+refresh_report_replica command. Everything else uses 'default'.
+"""
+import threading
+from contextlib import ContextDecorator
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS
+
+REPORTS = 'reports'
+
+_state = threading.local()
+
+
+class reporting(ContextDecorator):
+    """
+    Route the reads of a block, or of a decorated function, to the reports database
+    Only for read-only work: the reports connection does not see uncommitted writes
+    One instance decorates a view for every thread, so the nesting depth is
+    kept per thread rather than on the instance
+    """
+
+    def __enter__(self):
+        _state.depth = getattr(_state, 'depth', 0) + 1
+        return self
+
+    def __exit__(self, *exc):
+        _state.depth -= 1
+        return False
+
+
+class ReportRouter:
+    """
+    Send reads inside reporting() to the reports database, and all writes
+    and migrations to the default database
+    """
+
+    def db_for_read(self, model, **hints):
+        if getattr(_state, 'depth', 0) and REPORTS in settings.DATABASES:
+            return REPORTS
+        return None
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Both databases hold the same rows
+        return {obj1._state.db, obj2._state.db} <= {DEFAULT_DB_ALIAS, REPORTS} or None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db != REPORTS
+
+
+def apply_pragmas(sender, connection, **kwargs):
+    """
+    connection_created receiver setting FINANCES_SQLITE_PRAGMAS on new SQLite connections
+    """
+    if connection.vendor != 'sqlite':
+        return
+    pragmas = getattr(settings, 'FINANCES_SQLITE_PRAGMAS', {})
+    with connection.cursor() as cursor:
+        for name, value in pragmas.items():
+            cursor.execute("PRAGMA %s = %s" % (name, value))
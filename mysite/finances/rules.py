@@ -0,0 +1,89 @@
+import re
+import warnings
+
+# A backslash-escaped group number, not itself an escaped backslash
+BACKREFERENCE = re.compile(r'(?<!\\)(?:\\\\)*\\[1-9]')
+
+
+def combination_error(regex):
+    """
+    Why a rule's regex cannot be part of the combined pattern, or None
+    Inline global flags must start a pattern, group names must be unique and
+    group numbers shift, so none of them may appear in a rule
+    """
+    try:
+        with warnings.catch_warnings():
+            # Python before 3.11 only warns about flags in mid-pattern
+            warnings.simplefilter('error')
+            compiled = re.compile(regex)
+            re.compile("(?=.*?(?:%s))" % regex)
+    except (re.error, DeprecationWarning) as e:
+        return str(e)
+    if compiled.groupindex:
+        return "named groups are not supported"
+    if compiled.groups and (BACKREFERENCE.search(regex) or "(?(" in regex):
+        return "references to groups are not supported"
+    return None
+
+
+class CategoryMatcher:
+    """
+    All category rules compiled into a single regular expression
+
+    Each rule becomes one alternative made of lookaheads for its keyword and
+    regex, in priority order, so one match() call over a description finds the
+    highest-priority rule whose text conditions hold. Amount and account
+    conditions are checked on that rule only; in the rare case they fail, the
+    lower-priority rules are tried one at a time.
+    """
+    def __init__(self, rules):
+        # Rules saved before their regex was checked are left out rather than
+        # breaking every import
+        self.rules = [rule for rule in rules if not rule.regex or combination_error(rule.regex) is None]
+        self.patterns = [self.rule_pattern(rule) for rule in self.rules]
+        alternatives = ["%s(?P<r%d>)" % (pattern, i) for i, pattern in enumerate(self.patterns)]
+        self.combined = re.compile("(?:%s)" % "|".join(alternatives), re.IGNORECASE) if alternatives else None
+        self.singles = [re.compile(pattern, re.IGNORECASE) for pattern in self.patterns]
+
+    def __bool__(self):
+        return bool(self.rules)
+
+    @staticmethod
+    def rule_pattern(rule):
+        """
+        Anchored lookaheads matching a description that satisfies the rule's text conditions
+        """
+        pattern = ""
+        if rule.keyword:
+            pattern += "(?=.*?%s)" % re.escape(rule.keyword)
+        if rule.regex:
+            pattern += "(?=.*?(?:%s))" % rule.regex
+        return pattern
+
+    @staticmethod
+    def other_conditions_hold(rule, amount, dr_id, cr_id):
+        if rule.min_amount is not None and amount < rule.min_amount:
+            return False
+        if rule.max_amount is not None and amount > rule.max_amount:
+            return False
+        if rule.account_id is not None and rule.account_id not in (dr_id, cr_id):
+            return False
+        return True
+
+    def match(self, description, amount, dr_id=None, cr_id=None):
+        """
+        First rule, in priority order, that applies to a transaction, or None
+        """
+        if self.combined is None:
+            return None
+        found = self.combined.match(description)
+        if found is None:
+            return None
+        first = int(found.lastgroup[1:])
+        for i in range(first, len(self.rules)):
+            rule = self.rules[i]
+            if i > first and not self.singles[i].match(description):
+                continue
+            if self.other_conditions_hold(rule, amount, dr_id, cr_id):
+                return rule
+        return None
@@ -0,0 +1,121 @@
+"""
+Full-text search over transaction descriptions
+
+On SQLite (3.34 or later) descriptions are indexed in an FTS5 table with the
+trigram tokenizer, so any part of a merchant name of three or more
+characters is an index lookup. The table uses the transaction table as
+external content and is kept in sync by triggers, which also cover
+bulk_create, update() and raw deletes. Elsewhere, or for shorter terms,
+search falls back to description__icontains.
+"""
+from django.db import connections
+from django.db.models.expressions import RawSQL
+
+FTS_TABLE = 'finances_transaction_fts'
+MIN_TERM_LENGTH = 3
+
+CREATE_SQL = [
+    "CREATE VIRTUAL TABLE {fts} USING fts5("
+    "description, content='finances_transaction', content_rowid='id', tokenize='trigram')",
+    "CREATE TRIGGER {fts}_insert AFTER INSERT ON finances_transaction BEGIN "
+    "INSERT INTO {fts}(rowid, description) VALUES (new.id, new.description); END",
+    "CREATE TRIGGER {fts}_delete AFTER DELETE ON finances_transaction BEGIN "
+    "INSERT INTO {fts}({fts}, rowid, description) VALUES ('delete', old.id, old.description); END",
+    "CREATE TRIGGER {fts}_update AFTER UPDATE OF description ON finances_transaction BEGIN "
+    "INSERT INTO {fts}({fts}, rowid, description) VALUES ('delete', old.id, old.description); "
+    "INSERT INTO {fts}(rowid, description) VALUES (new.id, new.description); END",
+]
+
+DROP_SQL = [
+    "DROP TRIGGER IF EXISTS {fts}_insert",
+    "DROP TRIGGER IF EXISTS {fts}_delete",
+    "DROP TRIGGER IF EXISTS {fts}_update",
+    "DROP TABLE IF EXISTS {fts}",
+]
+
+
+def fts_supported(connection):
+    """
+    Whether a connection's database can hold the trigram index
+    """
+    if connection.vendor != 'sqlite':
+        return False
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT sqlite_version()")
+        version = tuple(int(part) for part in cursor.fetchone()[0].split("."))
+    return version >= (3, 34)
+
+
+def has_index(connection):
+    """
+    Whether the search index exists on a connection's database
+    """
+    if connection.vendor != 'sqlite':
+        return False
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = %s", [FTS_TABLE])
+        return cursor.fetchone() is not None
+
+
+def create_index(connection):
+    if fts_supported(connection):
+        with connection.cursor() as cursor:
+            for sql in CREATE_SQL:
+                cursor.execute(sql.format(fts=FTS_TABLE))
+        rebuild_index(connection)
+
+
+def drop_index(connection):
+    if connection.vendor == 'sqlite':
+        with connection.cursor() as cursor:
+            for sql in DROP_SQL:
+                cursor.execute(sql.format(fts=FTS_TABLE))
+
+
+def rebuild_index(connection):
+    """
+    Re-read every description into the index, then merge its segments
+    """
+    with connection.cursor() as cursor:
+        cursor.execute("INSERT INTO {fts}({fts}) VALUES ('rebuild')".format(fts=FTS_TABLE))
+        cursor.execute("INSERT INTO {fts}({fts}) VALUES ('optimize')".format(fts=FTS_TABLE))
+
+
+def match_phrase(term):
+    """
+    FTS5 query matching term literally
+    """
+    return '"%s"' % term.replace('"', '""')
+
+
+def uses_index(queryset, term):
+    return len(term) >= MIN_TERM_LENGTH and has_index(connections[queryset.db])
+
+
+def filter_description(queryset, term):
+    """
+    Transactions of a queryset whose description contains term, ignoring case
+    """
+    if not uses_index(queryset, term):
+        return queryset.filter(description__icontains=term)
+    return queryset.filter(id__in=RawSQL(
+        "SELECT rowid FROM {fts} WHERE {fts} MATCH %s".format(fts=FTS_TABLE), [match_phrase(term)]))
+
+
+def search(queryset, term, offset=0, limit=50):
+    """
+    Page of the transactions of a queryset whose description contains term,
+    best (BM25) matches first; newest first without the index
+    """
+    if not uses_index(queryset, term):
+        return list(filter_description(queryset, term).order_by('-timestamp', '-id')[offset:offset + limit])
+    # A join rather than id__in, so SQLite starts from the index matches and
+    # looks the transactions up by primary key
+    ranked = queryset.extra(
+        tables=[FTS_TABLE],
+        where=["{fts}.rowid = finances_transaction.id".format(fts=FTS_TABLE),
+               "{fts} MATCH %s".format(fts=FTS_TABLE)],
+        params=[match_phrase(term)],
+        select={'rank': "{fts}.rank".format(fts=FTS_TABLE)},
+        order_by=['rank', '-timestamp'])
+    return list(ranked[offset:offset + limit])
@@ -0,0 +1,275 @@
+"""
+Columnar ledger snapshots
+
+Each account's transactions are kept as flat binary columns next to the
+database, for analytics that would otherwise build a model instance per row:
+
+    timestamp   int64   seconds since the epoch (UTC)
+    amount      int64   cents, signed by the effect on the account
+    category    int32   code into codes.json "categories", -1 if none
+    account     int32   code of the other account into codes.json "accounts", -1 if none
+
+Columns are opened with np.memmap, so readers share the operating system's
+page cache instead of loading their own copies. Rows are in import order.
+meta.json holds the row count and is written last, so a reader never maps
+half an append. Imports append to a snapshot; other changes discard it, again
+once their database transaction commits, and the next reader rebuilds it.
+Open columns stay mapped after their files are removed. NumPy is imported on first use, as the models
+import this module in every process.
+"""
+import heapq
+import json
+import os
+import shutil
+import tempfile
+from urllib.parse import quote
+
+from django.conf import settings
+from django.db import transaction
+
+COLUMNS = (
+    ('timestamp', 'int64'),
+    ('amount', 'int64'),
+    ('category', 'int32'),
+    ('account', 'int32'),
+)
+
+SNAPSHOT_CHUNK_SIZE = 10000
+
+
+def snapshot_dir():
+    """
+    Directory holding the snapshots, by default beside the database
+    """
+    default = os.path.join(os.path.dirname(settings.DATABASES['default']['NAME']), 'snapshots')
+    return getattr(settings, 'FINANCES_SNAPSHOT_DIR', default)
+
+
+def snapshot_path(name):
+    return os.path.join(snapshot_dir(), quote(name, safe=''))
+
+
+def _read_json(path, default):
+    try:
+        with open(path) as file:
+            return json.load(file)
+    except FileNotFoundError:
+        return default
+
+
+def _write_json(path, value):
+    """
+    Replace a JSON file atomically
+    """
+    fd, temporary = tempfile.mkstemp(dir=os.path.dirname(path))
+    with os.fdopen(fd, 'w') as file:
+        json.dump(value, file)
+    os.replace(temporary, path)
+
+
+class LedgerSnapshot:
+    """
+    Read-only, memory-mapped view of an account's snapshot
+    Raises FileNotFoundError if the snapshot is missing or discarded while opening
+    """
+
+    def __init__(self, path):
+        import numpy as np
+        self.path = path
+        meta = _read_json(os.path.join(path, 'meta.json'), None)
+        if meta is None:
+            raise FileNotFoundError("No snapshot at %s" % path)
+        self.rows = meta['rows']
+        codes = _read_json(os.path.join(path, 'codes.json'), {})
+        self.categories = codes.get('categories', [])
+        self.accounts = codes.get('accounts', [])
+        for column, dtype in COLUMNS:
+            if self.rows:
+                values = np.memmap(os.path.join(path, column), dtype=dtype, mode='r', shape=(self.rows,))
+            else:
+                values = np.empty(0, dtype=dtype)
+            setattr(self, column, values)
+
+    def __len__(self):
+        return self.rows
+
+    def category_totals(self):
+        """
+        {category name or None: total cents}
+        """
+        import numpy as np
+        totals = np.bincount(self.category + 1, weights=self.amount, minlength=len(self.categories) + 1)
+        names = [None] + self.categories
+        return {names[code]: int(total) for code, total in enumerate(totals) if total}
+
+
+class Columns:
+    """
+    Snapshot rows gathered in memory before they are written
+    Categories and other accounts are held as local codes until then
+    """
+
+    def __init__(self):
+        self.chunks = []
+        self.categories = {}
+        self.accounts = {}
+
+    def add(self, name, rows):
+        """
+        Add (timestamp, amount, category, dr, cr) rows of the account name
+        """
+        import numpy as np
+        timestamps, amounts, categories, accounts = [], [], [], []
+        for timestamp, amount, category, dr, cr in rows:
+            timestamps.append(int(timestamp.timestamp()))
+            cents = int(abs(amount) * 100)
+            amounts.append(cents if cr == name else -cents)
+            other = dr if cr == name else cr
+            categories.append(-1 if category is None else self.categories.setdefault(category, len(self.categories)))
+            accounts.append(-1 if other is None else self.accounts.setdefault(other, len(self.accounts)))
+        if timestamps:
+            self.chunks.append([np.array(values, dtype=dtype) for values, (column, dtype)
+                                in zip((timestamps, amounts, categories, accounts), COLUMNS)])
+
+    def write(self, path):
+        """
+        Append the gathered rows to the snapshot at path
+        """
+        import numpy as np
+        if not self.chunks:
+            return
+        meta = _read_json(os.path.join(path, 'meta.json'), {'rows': 0})
+        codes = _read_json(os.path.join(path, 'codes.json'), {'categories': [], 'accounts': []})
+        translate = {}
+        for kind, local in (('categories', self.categories), ('accounts', self.accounts)):
+            known = {name: code for code, name in enumerate(codes[kind])}
+            for name in sorted(local, key=local.get):
+                if name not in known:
+                    known[name] = len(codes[kind])
+                    codes[kind].append(name)
+            # Local code -1 (none) is the last element, so it maps to -1
+            translate[kind] = np.array([known[name] for name in sorted(local, key=local.get)] + [-1],
+                                       dtype=np.int32)
+        _write_json(os.path.join(path, 'codes.json'), codes)
+        for chunk in self.chunks:
+            chunk[2] = translate['categories'][chunk[2]]
+            chunk[3] = translate['accounts'][chunk[3]]
+        for index, (column, dtype) in enumerate(COLUMNS):
+            with open(os.path.join(path, column), 'r+b' if meta['rows'] else 'wb') as file:
+                file.seek(meta['rows'] * np.dtype(dtype).itemsize)
+                for chunk in self.chunks:
+                    file.write(chunk[index].tobytes())
+        added = sum(len(chunk[0]) for chunk in self.chunks)
+        _write_json(os.path.join(path, 'meta.json'), {'rows': meta['rows'] + added})
+        self.chunks = []
+
+
+def _side_rows(transactions):
+    """
+    (id, timestamp, amount, category, dr, cr) rows of one side of an
+    account, in id order, read in keyset-paginated chunks of its account index
+    """
+    last = 0
+    while True:
+        rows = list(transactions.filter(id__gt=last).order_by('id')
+                    .values_list('id', 'timestamp', 'amount', 'category', 'dr', 'cr')[:SNAPSHOT_CHUNK_SIZE])
+        if not rows:
+            return
+        yield from rows
+        last = rows[-1][0]
+
+
+def rebuild_snapshot(account):
+    """
+    Write an account's snapshot from the transaction table, replacing any
+    existing one
+    Debits and credits are read separately and merged, rather than sorting
+    the OR of both sides for every chunk
+    Returns the LedgerSnapshot
+    """
+    os.makedirs(snapshot_dir(), exist_ok=True)
+    path = snapshot_path(account.name)
+    building = tempfile.mkdtemp(dir=snapshot_dir())
+    # account.dr and account.cr are the reverse relations of Transaction.dr and .cr
+    merged = heapq.merge(_side_rows(account.dr.all()), _side_rows(account.cr.all()))
+    columns = Columns()
+    chunk = []
+    previous = None
+    for row in merged:
+        if row[0] == previous:
+            continue
+        previous = row[0]
+        chunk.append(row[1:])
+        if len(chunk) >= SNAPSHOT_CHUNK_SIZE:
+            columns.add(account.name, chunk)
+            columns.write(building)
+            chunk = []
+    columns.add(account.name, chunk)
+    columns.write(building)
+    if not os.path.exists(os.path.join(building, 'meta.json')):
+        _write_json(os.path.join(building, 'meta.json'), {'rows': 0})
+    # Mapped before the rename, so it is this build whatever happens to path
+    snapshot = LedgerSnapshot(building)
+    # Readers still holding the old columns keep them until they close
+    shutil.rmtree(path, ignore_errors=True)
+    try:
+        os.rename(building, path)
+    except OSError:
+        # A concurrent rebuild renamed its snapshot into place first
+        shutil.rmtree(building, ignore_errors=True)
+    return snapshot
+
+
+def has_snapshot(name):
+    return os.path.exists(os.path.join(snapshot_path(name), 'meta.json'))
+
+
+def open_snapshot(account):
+    """
+    LedgerSnapshot of an account, built first if there is none
+    """
+    try:
+        return LedgerSnapshot(snapshot_path(account.name))
+    except FileNotFoundError:
+        return rebuild_snapshot(account)
+
+
+def append_to_snapshot(name, columns):
+    """
+    Write gathered Columns to an account's snapshot, if it has one
+    Without one there is nothing to keep current; it is built when next opened
+    """
+    path = snapshot_path(name)
+    if has_snapshot(name):
+        try:
+            columns.write(path)
+        except FileNotFoundError:
+            # Discarded while appending; drop whatever part was written
+            shutil.rmtree(path, ignore_errors=True)
+
+
+def _on_commit_too(function):
+    """
+    Call function now and, inside a database transaction, again once it
+    commits, so a snapshot rebuilt from the data before the commit is dropped
+    """
+    function()
+    if transaction.get_connection().in_atomic_block:
+        transaction.on_commit(function)
+
+
+def discard_snapshot(*names):
+    """
+    Remove snapshots that no longer match the transaction table
+    """
+    paths = [snapshot_path(name) for name in names if name is not None]
+
+    def discard():
+        for path in paths:
+            shutil.rmtree(path, ignore_errors=True)
+    if paths:
+        _on_commit_too(discard)
+
+
+def discard_all_snapshots():
+    _on_commit_too(lambda: shutil.rmtree(snapshot_dir(), ignore_errors=True))
@@ -1,3 +1,868 @@
-from django.test import TestCase
+import importlib
+import io
+import multiprocessing
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+from unittest import mock
+from datetime import datetime, timedelta
+from decimal import Decimal
+
+from django.apps import apps
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import CommandError, call_command
+from django.db import connection
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from .models import Account, Category, CategoryRule, ImportJob, MonthlyRollup, Transaction
+from .models import apply_category_rules, match_transfers, process_account_csv, purge_accounts, recategorize
+from .models import unmatch_transfer
+from .benchmark import compare, run_benchmark, startup_profile
+from .dashboard import dashboard
+from .export import export_querysets, export_rows
+from .instrumentation import profiles
+from .parsers import decode_lines, read_statement
+from .routers import REPORTS, ReportRouter, reporting
+from .search import filter_description, search
+from .snapshot import Columns, open_snapshot, rebuild_snapshot, snapshot_path
+from .validators import validate_regex
+
+
+STATEMENT = """12-3456-7890123-00,,,,
+28 Jan 2018,EFTPOS PAK N SAVE ;Ref,,-54.20,945.80
+31 Jan 2018,SALARY ;Ref,,1000.00,1945.80
+01 Feb 2018,EFTPOS PAK N SAVE ;Ref,,-61.15,1884.65
+01 Feb 2018,RENT ;Ref,,-400.00,1484.65
+"""
+
+locmem_cache = override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+
+
+class StatementMixin:
+    """
+    Statements written to temporary CSV files, removed at test cleanup
+    """
+    def statement_file(self, content=STATEMENT):
+        fd, path = tempfile.mkstemp(suffix='.csv')
+        with os.fdopen(fd, 'w') as file:
+            file.write(content)
+        self.addCleanup(os.remove, path)
+        return path
+
+    def import_statement(self, name, content=STATEMENT, **kwargs):
+        """
+        Import content into the account name
+        Returns the number of transactions created
+        """
+        return process_account_csv(self.statement_file(content), name, **kwargs)
+
+
+def query_plan(queryset):
+    """
+    SQLite EXPLAIN QUERY PLAN details for a queryset
+    """
+    sql, params = queryset.query.sql_with_params()
+    with connection.cursor() as cursor:
+        cursor.execute("EXPLAIN QUERY PLAN " + sql, params)
+        return [row[-1] for row in cursor.fetchall()]
+
+
+@unittest.skipUnless(connection.vendor == 'sqlite', "Query plans are SQLite specific")
+class TransactionQueryPlanTests(TestCase):
+    """
+    Main transaction access patterns must be served by an index
+    """
+    @classmethod
+    def setUpTestData(cls):
+        cls.account = Account.objects.create(name="12-3456-7890123-00")
+        cls.category = Category.objects.create(name="Groceries")
+        cls.start = timezone.make_aware(datetime(2017, 1, 1))
+        cls.end = timezone.make_aware(datetime(2018, 1, 1))
+
+    def assertIndexed(self, queryset, sorted_by_index=True):
+        plan = query_plan(queryset)
+        table = Transaction._meta.db_table
+        # A SCAN, even "USING INDEX", visits every row; only SEARCH is bounded
+        scans = [step for step in plan if step.startswith("SCAN") and table in step]
+        self.assertEqual(scans, [], "Table scan in query plan: %s" % plan)
+        if sorted_by_index:
+            self.assertFalse(any("TEMP B-TREE" in step for step in plan),
+                             "Sort not served by an index: %s" % plan)
+
+    def test_debit_range(self):
+        self.assertIndexed(Transaction.objects.filter(dr=self.account, timestamp__range=(self.start, self.end)))
+
+    def test_credit_range(self):
+        self.assertIndexed(Transaction.objects.filter(cr=self.account, timestamp__range=(self.start, self.end)))
+
+    def test_account_range(self):
+        # OR of both sides is two index searches merged, so the sort stays
+        self.assertIndexed(self.account.transactions().filter(timestamp__gte=self.start), sorted_by_index=False)
+
+    def test_export(self):
+        for transactions in export_querysets(self.account, since=self.start.date()).values():
+            self.assertIndexed(transactions)
+            last = transactions.filter(timestamp__gte=self.end).exclude(timestamp=self.end, id__lte=1)
+            self.assertIndexed(last)
+
+    def test_snapshot_rebuild(self):
+        self.assertIndexed(Transaction.objects.filter(cr=self.account, id__gt=1).order_by('id'))
+
+    def test_category_range(self):
+        self.assertIndexed(Transaction.objects.filter(category=self.category, timestamp__lt=self.end))
+
+    def test_date_range(self):
+        self.assertIndexed(Transaction.objects.filter(timestamp__range=(self.start, self.end)))
+
+    def test_balance_at(self):
+        history = self.account.balance_set.filter(timestamp__lte=self.end).order_by('-timestamp')
+        plan = query_plan(history)
+        self.assertFalse(any(step.startswith("SCAN") for step in plan), plan)
+        self.assertFalse(any("TEMP B-TREE" in step for step in plan), plan)
+
+
+class StatementParserTests(TestCase):
+    """
+    Each registered format is recognised and keeps the time of day it gives
+    """
+    def test_kiwibank_basic(self):
+        rows = list(read_statement(STATEMENT.replace("SALARY ;Ref", "SALARY -09:30;Ref").splitlines(True)))
+        self.assertEqual(len(rows), 4)
+        self.assertEqual(rows[1].description, "SALARY ")
+        self.assertEqual(timezone.localtime(rows[1].timestamp).time().isoformat(), "09:30:00")
+        self.assertEqual(timezone.localtime(rows[1].posted).time().isoformat(), "00:00:00")
+
+    def test_kiwibank_description_without_clock(self):
+        for desc in ("PAYMENT TO J-SMITH REF:123", "AP#123 TO A-B 12:5X", "TRANSFER-25:99"):
+            [row] = read_statement(["12-3456-7890123-00,,,,\n", "28 Jan 2018,%s ;Ref,,-1.00,0\n" % desc])
+            self.assertEqual(row.description, desc)
+            self.assertEqual(row.timestamp, row.posted)
+
+    def test_ofx(self):
+        ofx = ("OFXHEADER:100\n<OFX>\n<STMTTRN><TRNTYPE>DEBIT<DTPOSTED>20180128123000"
+               "<TRNAMT>-54.20<NAME>PAK N SAVE</STMTTRN>\n</OFX>\n")
+        [row] = read_statement(ofx.splitlines(True))
+        self.assertEqual((row.description, row.amount), ("PAK N SAVE", Decimal('-54.20')))
+        self.assertEqual(timezone.localtime(row.timestamp).hour, 12)
+
+    def test_qif(self):
+        [row] = read_statement("!Type:Bank\nD28/01/2018\nT-1,054.20\nPPAK N SAVE\n^\n".splitlines(True))
+        self.assertEqual((row.description, row.amount), ("PAK N SAVE", Decimal('-1054.20')))
+        self.assertEqual(timezone.localtime(row.timestamp).date().isoformat(), "2018-01-28")
+
+
+class StatementStreamTests(StatementMixin, TestCase):
+    """
+    Uploads are parsed from their chunks, whatever the chunk boundaries
+    """
+    def test_decode_lines(self):
+        data = STATEMENT.replace("\n", "\r\n").replace("SALARY", "SALÁRY").encode('utf-8-sig')
+        chunks = [data[i:i + 7] for i in range(0, len(data), 7)]
+        self.assertEqual("".join(decode_lines(chunks)), STATEMENT.replace("\n", "\r\n").replace("SALARY", "SALÁRY"))
+        self.assertEqual(len(list(read_statement(decode_lines(chunks)))), 4)
+
+    def test_batches(self):
+        account = Account.objects.create(name="12-3456-7890123-00")
+        self.assertEqual(self.import_statement(account.name, batch_size=2), 4)
+        # Past the unchanged-file check, so every batch is checked again
+        Account.objects.filter(pk=account.pk).update(transaction_file_hash='')
+        self.assertEqual(self.import_statement(account.name, batch_size=2), 0)
+        self.assertEqual(account.transactions().count(), 4)
+
+    @mock.patch('finances.models.KEEP_STATEMENTS', False)
+    def test_upload_without_storage(self):
+        account = Account.objects.create(name="12-3456-7890123-00")
+        account.transaction_file = SimpleUploadedFile("statement.csv", STATEMENT.encode())
+        account.save()
+        self.assertFalse(account.transaction_file)
+        self.assertEqual(account.transactions().count(), 4)
+        account.transaction_file = SimpleUploadedFile("statement.csv", STATEMENT.encode())
+        with mock.patch('finances.models.import_rows') as import_rows:
+            account.save()
+        self.assertFalse(import_rows.called)
+
+    def test_upload_bad_format(self):
+        account = Account(name="12-3456-7890123-00")
+        account.transaction_file = SimpleUploadedFile("statement.csv", b"not,a\nstatement\n")
+        with self.assertRaises(ValidationError) as raised:
+            account.full_clean()
+        self.assertIn('transaction_file', raised.exception.message_dict)
+
+
+class ImportJobTests(TestCase):
+    """
+    Uploads are queued and imported by the worker, and lost jobs are retried
+    """
+    def setUp(self):
+        media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media)
+        storage = override_settings(MEDIA_ROOT=media)
+        storage.enable()
+        self.addCleanup(storage.disable)
+        self.account = Account.objects.create(name="12-3456-7890123-00")
+        self.account.transaction_file = SimpleUploadedFile("statement.csv", STATEMENT.encode())
+        self.account.save()
+
+    def test_worker(self):
+        job = ImportJob.objects.get()
+        self.assertEqual((job.status, self.account.transactions().count()), (ImportJob.QUEUED, 0))
+        call_command('import_worker', once=True, stdout=io.StringIO())
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.rows_created), (ImportJob.DONE, 4))
+        self.assertEqual(self.account.transactions().count(), 4)
+        self.assertIsNone(ImportJob.claim_next())
+        job = self.account.queue_import()
+        call_command('import_worker', once=True, stdout=io.StringIO())
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.rows_created), (ImportJob.DONE, 0))
+
+    def test_requeue_stale(self):
+        job = ImportJob.claim_next()
+        self.assertIsNone(ImportJob.claim_next())
+        self.assertEqual(ImportJob.requeue_stale(), 0)
+        ImportJob.objects.filter(pk=job.pk).update(started=timezone.now() - timedelta(days=1))
+        self.assertEqual(ImportJob.requeue_stale(), 1)
+        self.assertEqual(ImportJob.claim_next().pk, job.pk)
+
+
+class PurgeTests(StatementMixin, TestCase):
+    """
+    Purging accounts deletes their transactions in a bounded number of queries
+    """
+    def import_rows(self, name, rows):
+        lines = ["%s,,,,\n" % name] + ["%02d Jan 2018,PAYMENT %d ;Ref,,-1.00,0\n" % (i % 28 + 1, i)
+                                       for i in range(rows)]
+        account = Account.objects.create(name=name)
+        self.import_statement(name, "".join(lines))
+        return account
+
+    def purge_queries(self, rows):
+        account = self.import_rows("purged-%d" % rows, rows)
+        account.transactions().first().tags.add("tagged")
+        with CaptureQueriesContext(connection) as queries:
+            deleted = purge_accounts(Account.objects.filter(pk=account.pk))
+        self.assertEqual(deleted, rows)
+        return len(queries)
+
+    def test_bounded_queries(self):
+        self.assertEqual(self.purge_queries(5), self.purge_queries(100))
+        self.assertFalse(Transaction.objects.exists())
+        self.assertFalse(Transaction.tags.through.objects.exists())
+
+    def test_transfer_keeps_other_side(self):
+        kept = self.import_rows("kept", 1)
+        purged = self.import_rows("purged", 1)
+        transfer = Transaction.objects.create(dr=kept, cr=purged, amount=Decimal('5.00'), description="TRANSFER",
+                                              timestamp=timezone.make_aware(datetime(2018, 1, 2)))
+        self.assertEqual(purge_accounts(Account.objects.filter(pk=purged.pk)), 1)
+        transfer.refresh_from_db()
+        self.assertEqual((transfer.dr_id, transfer.cr_id), ("kept", None))
+        self.assertEqual(Transaction.objects.count(), 2)
+
+
+class BalanceHistoryTests(StatementMixin, TestCase):
+    """
+    Balances are rebuilt from the earliest changed transaction onward
+    """
+    def setUp(self):
+        self.account = Account.objects.create(name="12-3456-7890123-00")
+        self.import_statement(self.account.name)
+
+    def history(self):
+        return [(timezone.localtime(b.timestamp).day, b.amount) for b in self.account.balance_set.all()]
+
+    def test_back_dated_insert(self):
+        Transaction.objects.create(dr=self.account, amount=Decimal('-100.00'), description="BACK DATED",
+                                   timestamp=timezone.make_aware(datetime(2018, 1, 15)))
+        self.account.refresh_from_db()
+        self.assertEqual(self.history(), [(15, Decimal('-100.00')), (28, Decimal('-154.20')),
+                                          (31, Decimal('845.80')), (1, Decimal('384.65'))])
+        self.assertEqual(self.account.current_balance, Decimal('384.65'))
+
+    def test_move_and_delete(self):
+        salary = Transaction.objects.get(description="SALARY")
+        salary.timestamp = timezone.make_aware(datetime(2018, 1, 1))
+        salary.save()
+        self.assertEqual(self.history(), [(1, Decimal('1000.00')), (28, Decimal('945.80')), (1, Decimal('484.65'))])
+        salary.delete()
+        self.account.refresh_from_db()
+        self.assertEqual(self.history(), [(28, Decimal('-54.20')), (1, Decimal('-515.35'))])
+        self.assertEqual(self.account.current_balance, Decimal('-515.35'))
+
+
+@locmem_cache
+class LedgerPaginationTests(StatementMixin, TestCase):
+    """
+    Ledger pages neither skip nor repeat rows, even between equal timestamps
+    """
+    def setUp(self):
+        self.account = Account.objects.create(name="12-3456-7890123-00")
+        self.import_statement(self.account.name, STATEMENT + "01 Feb 2018,RENT ;Ref,,-400.00,1084.65\n")
+
+    def test_pages(self):
+        url = reverse('account-ledger-json', args=[self.account.name])
+        seen = []
+        response = self.client.get(url, {'limit': 2}).json()
+        while True:
+            self.assertLessEqual(len(response['transactions']), 2)
+            seen += [t['id'] for t in response['transactions']]
+            if response['next'] is None:
+                break
+            response = self.client.get(url, {'limit': 2, 'before': response['next']}).json()
+        expected = list(self.account.transactions().order_by('-timestamp', '-id').values_list('id', flat=True))
+        self.assertEqual(seen, expected)
+        self.assertEqual(len(expected), 5)
+
+    def test_invalid_cursor(self):
+        url = reverse('account-ledger-json', args=[self.account.name])
+        self.assertEqual(self.client.get(url, {'before': "garbage"}).status_code, 404)
+
+
+@locmem_cache
+class TransactionAdminTests(StatementMixin, TestCase):
+    """
+    Bulk actions with an intermediate page apply to every selected row, and
+    account inlines load a page at a time
+    """
+    def setUp(self):
+        account = Account.objects.create(name="12-3456-7890123-00")
+        self.import_statement(account.name)
+        self.category = Category.objects.create(name="Groceries")
+        self.client.force_login(User.objects.create_superuser("admin", "admin@example.com", "password"))
+
+    def test_recategorize_select_across(self):
+        url = reverse('admin:finances_transaction_changelist')
+        page = list(Transaction.objects.values_list('id', flat=True)[:1])
+        response = self.client.post(url, {'action': 'recategorize', 'index': 0, 'select_across': 1,
+                                          '_selected_action': page})
+        self.assertEqual(response.context['selected'], [str(pk) for pk in page])
+        self.client.post(url, {'action': 'recategorize', 'select_across': 1, '_selected_action': page,
+                               'category': self.category.pk, 'apply': "Set category"})
+        self.assertFalse(Transaction.objects.exclude(category=self.category).exists())
+
+    def test_account_inlines_on_demand(self):
+        url = reverse('admin:finances_account_change', args=["12-3456-7890123-00"])
+        response = self.client.get(url)
+        self.assertNotContains(response, "PAK N SAVE")
+        self.assertContains(response, "?dr_page=1")
+        response = self.client.get(url, {'dr_page': 1, '_changelist_filters': "q=x"})
+        self.assertContains(response, "PAK N SAVE")
+        self.assertNotContains(response, "SALARY")
+        self.assertContains(response, "cr_page=1")
+        self.assertContains(response, "_changelist_filters=q%3Dx")
+
+
+class FingerprintBackfillTests(StatementMixin, TestCase):
+    """
+    Rows imported before fingerprints existed are not imported again
+    """
+    def test_reimport_after_backfill(self):
+        account = Account.objects.create(name="12-3456-7890123-00")
+        for row in read_statement(STATEMENT.splitlines(True)):
+            Transaction.objects.create(dr=account if row.amount <= 0 else None, cr=account if row.amount > 0 else None,
+                                       amount=row.amount, description=row.description, timestamp=row.posted)
+        migration = importlib.import_module('finances.migrations.0022_backfill_fingerprints')
+        migration.backfill_fingerprints(apps, mock.Mock(connection=connection))
+        self.assertFalse(Transaction.objects.filter(fingerprint__isnull=True).exists())
+        self.assertEqual(self.import_statement(account.name), 0)
+
+
+class MonthlyRollupTests(StatementMixin, TestCase):
+    """
+    Rollups must match a full aggregate of the transaction table
+    """
+    def setUp(self):
+        self.account = Account.objects.create(name="12-3456-7890123-00")
+        self.import_statement(self.account.name)
+
+    def test_import(self):
+        self.assertEqual(MonthlyRollup.objects.inconsistencies(self.account), [])
+        january = MonthlyRollup.objects.get(account=self.account, month__month=1)
+        self.assertEqual((january.total, january.count), (Decimal('945.80'), 2))
+
+    def test_recategorize(self):
+        groceries = Category.objects.create(name="Groceries")
+        recategorize(Transaction.objects.filter(description__startswith="EFTPOS"), groceries)
+        self.assertEqual(MonthlyRollup.objects.inconsistencies(self.account), [])
+        report = MonthlyRollup.objects.report(accounts=[self.account])
+        self.assertEqual([(row['category'], row['total']) for row in report if row['month'].month == 2],
+                         [(None, Decimal('-400.00')), ('Groceries', Decimal('-61.15'))])
+
+    def test_edit(self):
+        t = Transaction.objects.get(description="RENT")
+        t.timestamp = timezone.make_aware(datetime(2018, 1, 15))
+        t.save()
+        self.assertEqual(MonthlyRollup.objects.inconsistencies(self.account), [])
+
+
+class CategoryRuleTests(StatementMixin, TestCase):
+    """
+    Rules apply in priority order, both on import and in batch
+    """
+    def setUp(self):
+        self.account = Account.objects.create(name="12-3456-7890123-00")
+        groceries = Category.objects.create(name="Groceries")
+        housing = Category.objects.create(name="Housing")
+        self.big_shop = CategoryRule.objects.create(category=housing, keyword="pak n save", max_amount=-60, priority=1)
+        self.shop = CategoryRule.objects.create(category=groceries, regex=r"^EFTPOS\b", priority=2)
+        self.rent = CategoryRule.objects.create(category=housing, keyword="rent", account=self.account, priority=3)
+
+    def categories(self):
+        return dict(Transaction.objects.values_list('amount', 'category'))
+
+    def test_import(self):
+        self.import_statement(self.account.name)
+        self.assertEqual(self.categories(), {
+            Decimal('-54.20'): 'Groceries',
+            Decimal('1000.00'): None,
+            Decimal('-61.15'): 'Housing',
+            Decimal('-400.00'): 'Housing',
+        })
+        self.shop.refresh_from_db()
+        self.assertEqual(self.shop.hits, 1)
+
+    def test_apply(self):
+        CategoryRule.objects.all().delete()
+        self.import_statement(self.account.name)
+        CategoryRule.objects.create(category_id="Groceries", keyword="eftpos")
+        self.assertEqual(apply_category_rules(Transaction.objects.all(), batch_size=1), 2)
+        self.assertEqual(sorted(self.categories().values(), key=str), ['Groceries', 'Groceries', None, None])
+        self.assertEqual(MonthlyRollup.objects.inconsistencies(self.account), [])
+
+    def test_uncombinable_regex(self):
+        for regex in ("(?i)rent", "(?P<r0>rent)", r"(r)\1", "(r)(?(1)e|x)", "rent("):
+            with self.assertRaises(ValidationError, msg=regex):
+                validate_regex(regex)
+        for regex in (r"\\1", r"(?:a|b)\d+", r"(pak|rent)"):
+            validate_regex(regex)
+        # A rule saved before it was checked is skipped, not fatal to imports
+        CategoryRule.objects.create(category_id="Groceries", regex="(?P<r0>x)", priority=0)
+        self.assertEqual(self.import_statement(self.account.name), 4)
+        self.assertEqual(self.categories()[Decimal('-54.20')], 'Groceries')
+
+
+class TaggingTests(StatementMixin, TestCase):
+    """
+    Bulk tag writes and tag-filtered queries
+    """
+    def setUp(self):
+        self.account = Account.objects.create(name="12-3456-7890123-00")
+        self.import_statement(self.account.name)
+
+    def test_bulk_add_remove(self):
+        shopping = Transaction.objects.filter(description__startswith="EFTPOS")
+        self.assertEqual(shopping.add_tags("shopping", "weekly"), 4)
+        self.assertEqual(shopping.add_tags("shopping"), 0)
+        self.assertEqual(Transaction.objects.tagged("weekly").count(), 2)
+        self.assertEqual(shopping.remove_tags("weekly"), 2)
+        self.assertEqual(Transaction.objects.tagged("weekly").count(), 0)
+        with self.assertNumQueries(2):
+            tags = [[tag.name for tag in t.tags.all()] for t in Transaction.objects.with_tags()]
+        self.assertEqual(sorted(tags), [[], [], ["shopping"], ["shopping"]])
+
+    def test_category_tags(self):
+        Category.objects.create(name="Groceries").tags.add("essential")
+        self.assertEqual(list(Category.objects.tagged("essential")), [Category.objects.get(name="Groceries")])
+
+
+class ExportTests(StatementMixin, TestCase):
+    """
+    Exports stream every matching row exactly once
+    """
+    def setUp(self):
+        self.account = Account.objects.create(name="12-3456-7890123-00")
+        self.import_statement(self.account.name)
+
+    def test_chunks(self):
+        rows = list(export_rows(self.account, chunk_size=1))
+        self.assertEqual([row[3] for row in rows],
+                         [Decimal('-54.20'), Decimal('1000.00'), Decimal('-61.15'), Decimal('-400.00')])
+
+    def test_csv(self):
+        url = reverse('account-export', args=[self.account.name, 'csv'])
+        response = self.client.get(url, {'since': '2018-02-01', 'category': ''})
+        self.assertTrue(response.streaming)
+        lines = b"".join(response.streaming_content).decode().splitlines()
+        self.assertEqual(lines[0], "id,timestamp,description,amount,category,dr,cr")
+        self.assertEqual([line.split(",")[3] for line in lines[1:]], ['-61.15', '-400.00'])
+
+    def test_ndjson(self):
+        url = reverse('account-export', args=[self.account.name, 'ndjson'])
+        response = self.client.get(url, {'until': '2018-01-31'})
+        self.assertEqual(len(b"".join(response.streaming_content).splitlines()), 2)
+
+
+@locmem_cache
+class CategoryReportTests(StatementMixin, TestCase):
+    """
+    Report amounts are whole cents, however the database sums them
+    """
+    def test_report(self):
+        account = Account.objects.create(name="12-3456-7890123-00")
+        self.import_statement(account.name)
+        months = self.client.get(reverse('category-report'), {'since': '2018-02'}).json()['months']
+        self.assertEqual([(row['total'], row['min'], row['max']) for row in months],
+                         [("-461.15", "-400.00", "-61.15")])
+
+
+@locmem_cache
+class BalanceSeriesTests(StatementMixin, TestCase):
+    """
+    Balance series are bounded by the requested resolution
+    """
+    def setUp(self):
+        self.account = Account.objects.create(name="12-3456-7890123-00")
+        self.import_statement(self.account.name)
+        self.url = reverse('account-balance-series', args=[self.account.name])
+
+    def test_monthly_ohlc(self):
+        series = self.client.get(self.url, {'bucket': 'month'}).json()['series']
+        self.assertEqual([(row['open'], row['high'], row['low'], row['close']) for row in series],
+                         [(-54.2, 945.8, -54.2, 945.8), (484.65, 484.65, 484.65, 484.65)])
+
+    def test_points(self):
+        series = self.client.get(self.url, {'points': 2}).json()['series']
+        self.assertEqual([row['balance'] for row in series], [-54.2, 484.65])
+
+    def test_dataframe(self):
+        frame = self.account.get_balance_dataframe()
+        self.assertEqual([float(amount) for amount in frame['amount']], [-54.2, 945.8, 484.65])
+
+
+class LedgerSnapshotTests(StatementMixin, TestCase):
+    """
+    Snapshots match the transaction table, through appends and edits
+    """
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        snapshot_settings = override_settings(FINANCES_SNAPSHOT_DIR=directory)
+        snapshot_settings.enable()
+        self.addCleanup(snapshot_settings.disable)
+        self.account = Account.objects.create(name="12-3456-7890123-00")
+        Category.objects.create(name="Housing")
+        self.import_statement(self.account.name)
+
+    def test_build_and_append(self):
+        snapshot = open_snapshot(self.account)
+        self.assertEqual(snapshot.category_totals(), {None: 48465})
+        columns = Columns()
+        columns.add(self.account.name, [
+            (timezone.now(), Decimal('-12.34'), "Housing", self.account.name, None),
+            (timezone.now(), Decimal('20.00'), None, "other", self.account.name),
+        ])
+        columns.write(snapshot_path(self.account.name))
+        snapshot = open_snapshot(self.account)
+        self.assertEqual(len(snapshot), 6)
+        self.assertEqual(snapshot.category_totals(), {None: 50465, "Housing": -1234})
+        self.assertEqual([snapshot.accounts[code] for code in snapshot.account if code >= 0], ["other"])
+
+    def test_discarded_on_edit(self):
+        open_snapshot(self.account)
+        t = Transaction.objects.get(description="RENT")
+        t.category_id = "Housing"
+        t.save()
+        self.assertFalse(os.path.exists(snapshot_path(self.account.name)))
+        self.assertEqual(open_snapshot(self.account).category_totals(), {None: 88465, "Housing": -40000})
+
+    def test_concurrent_changes(self):
+        path = snapshot_path(self.account.name)
+        open_snapshot(self.account)
+        os.remove(os.path.join(path, 'meta.json'))
+        self.assertEqual(open_snapshot(self.account).category_totals(), {None: 48465})
+        with mock.patch('finances.snapshot.os.rename', side_effect=OSError):
+            self.assertEqual(len(rebuild_snapshot(self.account)), 4)
+        self.assertEqual(os.listdir(os.path.dirname(path)), [])
+        with mock.patch('finances.snapshot.transaction.on_commit') as on_commit:
+            recategorize(self.account.transactions(), Category.objects.get())
+        self.assertTrue(on_commit.called)
+
+    def test_rebuild_in_chunks(self):
+        with mock.patch('finances.snapshot.SNAPSHOT_CHUNK_SIZE', 1):
+            snapshot = rebuild_snapshot(self.account)
+        expected = self.account.transactions().order_by('id').values_list('timestamp', flat=True)
+        self.assertEqual(list(snapshot.timestamp), [int(timestamp.timestamp()) for timestamp in expected])
+        self.assertEqual(snapshot.category_totals(), {None: 48465})
+
+    def test_rows_gathered_only_for_a_snapshot(self):
+        savings = Account.objects.create(name="12-3456-7890123-01")
+        with mock.patch.object(Columns, 'add') as add:
+            self.import_statement(savings.name, TransferMatchingTests.SAVINGS)
+        self.assertFalse(add.called)
+        open_snapshot(self.account)
+        with mock.patch.object(Columns, 'add') as add:
+            self.import_statement(self.account.name, STATEMENT + "02 Feb 2018,RENT ;Ref,,-1.00,0\n")
+        self.assertTrue(add.called)
+
+
+@locmem_cache
+class PageCacheTests(StatementMixin, TestCase):
+    """
+    Pages are served from the cache until their data changes
+    """
+    def setUp(self):
+        cache.clear()
+        self.account = Account.objects.create(name="12-3456-7890123-00")
+        self.url = reverse('account-ledger-json', args=[self.account.name])
+
+    def test_conditional_get(self):
+        response = self.client.get(self.url)
+        self.assertIn('ETag', response)
+        self.assertIn('Last-Modified', response)
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
+            self.assertEqual(self.client.get(self.url).content, response.content)
+
+    def test_invalidated_by_import(self):
+        etag = self.client.get(self.url)['ETag']
+        other = reverse('account-detail', args=["other"])
+        Account.objects.create(name="other")
+        other_etag = self.client.get(other)['ETag']
+        self.import_statement(self.account.name)
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()['transactions']), 4)
+        self.assertEqual(self.client.get(other, HTTP_IF_NONE_MATCH=other_etag).status_code, 304)
+        Transaction.objects.filter(description="RENT").get().delete()
+        self.assertEqual(len(self.client.get(self.url).json()['transactions']), 3)
+
+
+class BenchmarkTests(TestCase):
+    """
+    The benchmark harness runs end to end on a small statement
+    """
+    def test_run_and_compare(self):
+        results = run_benchmark(200, repeat=1)
+        self.assertEqual(results['rows'], 200)
+        self.assertFalse(Account.objects.exists())
+        baseline = {'200': dict(results, ledger_queries=results['ledger_queries'] - 1)}
+        self.assertEqual(compare({'200': results}, baseline),
+                         [('200', 'ledger_queries', results['ledger_queries'] - 1, results['ledger_queries'])])
+
+    def test_startup_skips_pandas(self):
+        metrics, top, heavy = startup_profile('wsgi', repeat=1, cwd=settings.BASE_DIR)
+        self.assertEqual(heavy, [])
+        self.assertGreater(metrics['rss_kb'], 0)
+        self.assertEqual(top[0][1], "mysite.wsgi")
+
+
+@locmem_cache
+class ProfilingTests(TestCase):
+    """
+    Sampled requests are profiled and summarised for staff
+    """
+    @mock.patch('finances.instrumentation.SAMPLE_RATE', 1.0)
+    def test_profile(self):
+        profiles.clear()
+        Account.objects.create(name="12-3456-7890123-00")
+        self.client.get(reverse('account-ledger', args=["12-3456-7890123-00"]))
+        [profile] = profiles
+        self.assertEqual(profile['endpoint'], 'account-ledger')
+        self.assertGreater(profile['queries'], 0)
+        self.assertEqual(self.client.get(reverse('profile-report')).status_code, 302)
+        self.client.force_login(User.objects.create_user("staff", is_staff=True))
+        response = self.client.get(reverse('profile-report'))
+        self.assertIn('account-ledger', [row['endpoint'] for row in response.context['endpoints']])
+
+
+class ReportRouterTests(TestCase):
+    """
+    Only reads inside reporting() go to the reports database, when there is one
+    """
+    def test_routing(self):
+        router = ReportRouter()
+        with reporting():
+            self.assertIsNone(router.db_for_read(MonthlyRollup))
+        with mock.patch.dict(settings.DATABASES, {REPORTS: dict(settings.DATABASES['default'])}):
+            self.assertIsNone(router.db_for_read(MonthlyRollup))
+            with reporting():
+                self.assertEqual(router.db_for_read(MonthlyRollup), REPORTS)
+                self.assertEqual(router.db_for_write(MonthlyRollup), 'default')
+            self.assertFalse(router.allow_migrate(REPORTS, 'finances'))
+
+    def test_shared_instance(self):
+        router = ReportRouter()
+        shared = reporting()
+        entered, exited = threading.Event(), threading.Event()
+
+        def other_thread():
+            with shared:
+                entered.set()
+                exited.wait()
+
+        with mock.patch.dict(settings.DATABASES, {REPORTS: dict(settings.DATABASES['default'])}):
+            thread = threading.Thread(target=other_thread)
+            self.addCleanup(thread.join)
+            self.addCleanup(exited.set)
+            with shared:
+                with shared:
+                    thread.start()
+                    entered.wait()
+                self.assertEqual(router.db_for_read(MonthlyRollup), REPORTS)
+            self.assertIsNone(router.db_for_read(MonthlyRollup))
+
+
+class SearchTests(StatementMixin, TestCase):
+    """
+    Description search follows imports, edits and deletes
+    """
+    def setUp(self):
+        self.account = Account.objects.create(name="12-3456-7890123-00")
+        self.import_statement(self.account.name)
+
+    def descriptions(self, term):
+        return sorted(t.description for t in search(Transaction.objects.all(), term))
+
+    def test_partial_terms(self):
+        self.assertEqual(self.descriptions("n sav"), ["EFTPOS PAK N SAVE", "EFTPOS PAK N SAVE"])
+        self.assertEqual(self.descriptions("ALAR"), ["SALARY"])
+        self.assertEqual(self.descriptions("re"), ["RENT"])
+        self.assertEqual(filter_description(self.account.transactions(), 'pak "n').count(), 0)
+
+    def test_sync(self):
+        rent = Transaction.objects.get(description="RENT")
+        rent.description = "MORTGAGE"
+        rent.save()
+        Transaction.objects.filter(description="SALARY").delete()
+        self.assertEqual(self.descriptions("RENT"), [])
+        self.assertEqual(self.descriptions("gage"), ["MORTGAGE"])
+        self.assertEqual(self.descriptions("salary"), [])
+
+    def test_endpoint(self):
+        response = self.client.get(reverse('search-json'), {'q': 'eftpos', 'account': self.account.name})
+        self.assertEqual(len(response.json()['transactions']), 2)
+        self.assertIsNone(response.json()['next'])
+
+
+class TransferMatchingTests(StatementMixin, TestCase):
+    """
+    A transfer imported from both accounts of one owner becomes one two-sided
+    transaction
+    """
+    SAVINGS = """12-3456-7890123-01,,,,
+02 Feb 2018,RENT ;Ref,,400.00,400.00
+20 Feb 2018,INTEREST ;Ref,,1.00,401.00
+"""
+
+    def setUp(self):
+        self.owner = User.objects.create(username="owner")
+        self.cheque = Account.objects.create(name="12-3456-7890123-00", owner=self.owner)
+        self.savings = Account.objects.create(name="12-3456-7890123-01", owner=self.owner)
+        self.import_statement(self.cheque.name)
+        self.import_statement(self.savings.name, self.SAVINGS)
+
+    def test_import(self):
+        transfer = Transaction.objects.get(description="RENT")
+        self.assertEqual((transfer.dr_id, transfer.cr_id), (self.cheque.name, self.savings.name))
+        self.assertEqual(Transaction.objects.count(), 5)
+        self.savings.refresh_from_db()
+        self.assertEqual(self.savings.current_balance, Decimal('401.00'))
+        self.assertEqual(MonthlyRollup.objects.inconsistencies(self.cheque), [])
+        self.assertEqual(MonthlyRollup.objects.inconsistencies(self.savings), [])
+
+    def test_reimport(self):
+        # Past the unchanged-file check, so every row is fingerprinted again
+        Account.objects.filter(pk=self.savings.pk).update(transaction_file_hash='')
+        self.assertEqual(self.import_statement(self.savings.name, self.SAVINGS), 0)
+        self.assertEqual(Transaction.objects.count(), 5)
+        self.assertEqual(match_transfers(), 0)
+
+    def test_unmatch(self):
+        credit = unmatch_transfer(Transaction.objects.get(description="RENT"))
+        self.assertEqual((credit.cr_id, credit.amount, credit.description), (self.savings.name, Decimal('400.00'), "RENT"))
+        self.assertEqual(timezone.localtime(credit.timestamp).date().isoformat(), "2018-02-02")
+        self.assertEqual(Transaction.objects.filter(cr__isnull=True, description="RENT").count(), 1)
+        self.savings.refresh_from_db()
+        self.assertEqual(self.savings.current_balance, Decimal('401.00'))
+        self.assertEqual(MonthlyRollup.objects.inconsistencies(self.cheque), [])
+        self.assertEqual(MonthlyRollup.objects.inconsistencies(self.savings), [])
+
+    def test_other_owner(self):
+        unmatch_transfer(Transaction.objects.get(description="RENT"))
+        Account.objects.filter(pk=self.savings.pk).update(owner=User.objects.create(username="other"))
+        self.assertEqual(match_transfers(), 0)
+        Account.objects.update(owner=None)
+        self.assertEqual(match_transfers(), 0)
+        Account.objects.update(owner=self.owner)
+        self.assertEqual(match_transfers(), 1)
+
+    def test_ambiguous(self):
+        credit = unmatch_transfer(Transaction.objects.get(description="RENT"))
+        other = Account.objects.create(name="12-3456-7890123-02", owner=self.owner)
+        Transaction.objects.create(cr=other, amount=credit.amount, description="RENT",
+                                   timestamp=credit.timestamp + timedelta(hours=1))
+        self.assertEqual(match_transfers(), 0)
+
+
+class ImportStatementsTests(TestCase):
+    """
+    A directory of statements imports in parallel, one failure at a time
+    """
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        for name, content in (("12-3456-7890123-00.csv", STATEMENT),
+                              ("12-3456-7890123-01.csv", TransferMatchingTests.SAVINGS),
+                              ("broken.csv", "12-3456-7890123-02,,,,\nnot a date,RENT ;Ref,,-1.00,0\n")):
+            with open(os.path.join(self.directory, name), 'w') as file:
+                file.write(content)
+
+    def test_import(self):
+        stdout, stderr = io.StringIO(), io.StringIO()
+        with self.assertRaisesMessage(CommandError, "1 of 3 files failed: broken.csv"):
+            call_command('import_statements', self.directory, create=True, jobs=2, stdout=stdout, stderr=stderr)
+        # Created accounts have no owner, so the transfer stays as two rows
+        self.assertEqual(Transaction.objects.count(), 6)
+        self.assertEqual(Account.objects.get(name="12-3456-7890123-01").current_balance, Decimal('401.00'))
+        self.assertIn("broken.csv failed", stderr.getvalue())
+        self.assertFalse(Account.objects.filter(name="broken").exists())
+        os.remove(os.path.join(self.directory, "broken.csv"))
+        call_command('import_statements', self.directory, jobs=1, stdout=stdout)
+        self.assertEqual(stdout.getvalue().count("unchanged since last import"), 2)
+
+    def test_spawned_workers(self):
+        # As on macOS and Windows, workers start without this process's state
+        self.addCleanup(multiprocessing.set_start_method, multiprocessing.get_start_method(allow_none=True),
+                        force=True)
+        multiprocessing.set_start_method('spawn', force=True)
+        with self.assertRaisesMessage(CommandError, "1 of 3 files failed: broken.csv"):
+            call_command('import_statements', self.directory, create=True, jobs=2,
+                         stdout=io.StringIO(), stderr=io.StringIO())
+        self.assertEqual(Transaction.objects.count(), 6)
+
+
+class DashboardTests(StatementMixin, TransactionTestCase):
+    """
+    Dashboard panels give the same figures run concurrently or in turn
+    """
+    def setUp(self):
+        account = Account.objects.create(name="12-3456-7890123-00")
+        self.import_statement(account.name)
+        Account.objects.create(name="empty")
+        recategorize(Transaction.objects.filter(description="RENT"), Category.objects.create(name="Rent"))
+        self.now = timezone.make_aware(datetime(2018, 2, 14))
+
+    def test_panels(self):
+        figures = dashboard(self.now)
+        self.assertEqual(figures['balances'], [{'account': "12-3456-7890123-00", 'balance': "484.65"},
+                                               {'account': "empty", 'balance': None}])
+        self.assertEqual(figures['month_to_date'], [{'category': "Rent", 'total': "-400.00"},
+                                                    {'category': None, 'total': "-61.15"}])
+        self.assertEqual([t['description'] for t in figures['recent']][:2], ["RENT", "EFTPOS PAK N SAVE"])
+        self.assertEqual(figures['uncategorized'], 3)
+        with mock.patch('finances.dashboard.DASHBOARD_WORKERS', 0):
+            self.assertEqual(dashboard(self.now), figures)
+
+    def test_endpoint(self):
+        response = self.client.get(reverse('dashboard'))
+        self.assertContains(response, "3 transactions without a category")
 
-# Create your tests here.
@@ -0,0 +1,79 @@
+"""
+Downsampled balance histories for charts
+
+The balance history is read as two columns and reduced with vectorized
+pandas/NumPy operations, so the size of a response depends on the
+requested resolution rather than on the length of the history. Both are
+imported on first use, so processes that never chart a balance skip them.
+"""
+from django.utils import timezone
+
+# pandas resample rules of the OHLC bucket sizes; weeks start on Monday
+BUCKETS = {
+    'day': dict(rule='D'),
+    'week': dict(rule='W-MON', label='left', closed='left'),
+    'month': dict(rule='MS'),
+}
+
+
+def balance_series(account, since=None, until=None):
+    """
+    pandas Series of an account's balance history, indexed by local time
+    """
+    import numpy as np
+    import pandas as pd
+    history = account.balance_set.order_by('timestamp')
+    if since is not None:
+        history = history.filter(timestamp__gte=since)
+    if until is not None:
+        history = history.filter(timestamp__lt=until)
+    rows = list(history.values_list('timestamp', 'amount'))
+    timestamps = [timestamp for timestamp, amount in rows]
+    amounts = np.array([amount for timestamp, amount in rows], dtype=float)
+    index = pd.DatetimeIndex(timestamps, tz='UTC').tz_convert(timezone.get_current_timezone_name())
+    return pd.Series(amounts, index=index)
+
+
+def ohlc(series, bucket):
+    """
+    Open, high, low and close balance of each day, week or month that has
+    balance changes, as a DataFrame indexed by the start of the bucket
+    """
+    return series.resample(**BUCKETS[bucket]).ohlc().dropna()
+
+
+def lttb(x, y, points):
+    """
+    Indices of the points kept by Largest-Triangle-Three-Buckets downsampling
+    Each bucket keeps the point forming the largest triangle with the point
+    kept from the previous bucket and the average of the next bucket
+    """
+    import numpy as np
+    size = len(x)
+    if points >= size or points < 3:
+        return np.arange(size) if points >= size else np.array([0, size - 1][:points], dtype=int)
+    edges = np.linspace(1, size - 1, points - 1).astype(int)
+    selected = np.empty(points, dtype=int)
+    selected[0] = 0
+    selected[-1] = size - 1
+    kept = 0
+    for i in range(points - 2):
+        start, end = edges[i], edges[i + 1]
+        if i + 2 < len(edges):
+            next_x = x[end:edges[i + 2]].mean()
+            next_y = y[end:edges[i + 2]].mean()
+        else:
+            next_x, next_y = x[-1], y[-1]
+        areas = np.abs((x[kept] - next_x) * (y[start:end] - y[kept])
+                       - (x[kept] - x[start:end]) * (next_y - y[kept]))
+        kept = start + int(areas.argmax())
+        selected[i + 1] = kept
+    return selected
+
+
+def downsample(series, points):
+    """
+    Series reduced to at most points points with LTTB
+    """
+    x = series.index.asi8.astype(float)
+    return series.iloc[lttb(x, series.values, points)]
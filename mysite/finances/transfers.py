@@ -0,0 +1,59 @@
+"""
+Transfer matching
+
+A transfer between two accounts is imported twice: as a debit from one
+account's statement and as a credit from the other's. Candidates are
+hash-joined on amount, and within each amount debits and credits are walked
+in time order, so the cost is close to linear in the number of rows rather
+than pairwise.
+"""
+from collections import defaultdict, namedtuple
+
+Leg = namedtuple('Leg', 'id timestamp amount dr cr fingerprint category description')
+
+
+def pair_transfers(rows, window, owners):
+    """
+    (debit, credit) pairs of Legs from one-sided transaction rows
+    A debit pairs with the unpaired credit of the same absolute amount in
+    another account of the same owner no more than window apart, if there is
+    exactly one; a debit with several candidates is ambiguous and left alone
+    owners is {account name: owner}; accounts without an owner never pair
+    """
+    debits = defaultdict(list)
+    credits = defaultdict(list)
+    for row in rows:
+        leg = Leg(*row)
+        if not leg.amount:
+            continue
+        if leg.dr is not None:
+            debits[abs(leg.amount)].append(leg)
+        else:
+            credits[abs(leg.amount)].append(leg)
+    pairs = []
+    for amount, outgoing in debits.items():
+        incoming = credits.get(amount)
+        if not incoming:
+            continue
+        outgoing.sort(key=lambda leg: (leg.timestamp, leg.id))
+        incoming.sort(key=lambda leg: (leg.timestamp, leg.id))
+        paired = set()
+        start = 0
+        for debit in outgoing:
+            while start < len(incoming) and incoming[start].timestamp < debit.timestamp - window:
+                start += 1
+            owner = owners.get(debit.dr)
+            if owner is None:
+                continue
+            candidates = []
+            for index in range(start, len(incoming)):
+                credit = incoming[index]
+                if credit.timestamp > debit.timestamp + window:
+                    break
+                if index in paired or credit.cr == debit.dr or owners.get(credit.cr) != owner:
+                    continue
+                candidates.append(index)
+            if len(candidates) == 1:
+                paired.add(candidates[0])
+                pairs.append((debit, incoming[candidates[0]]))
+    return pairs
@@ -6,5 +6,15 @@ from . import views
 
 urlpatterns = [
     path('accounts/', views.AccountListView.as_view(), name='accounts'),
-    path('account/<str:pk>', views.AccountDetailView.as_view(), name='account-detail')
+    path('account/<str:pk>', views.AccountDetailView.as_view(), name='account-detail'),
+    path('account/<str:pk>/ledger', views.AccountLedgerView.as_view(), name='account-ledger'),
+    path('account/<str:pk>/ledger.json', views.AccountLedgerJsonView.as_view(), name='account-ledger-json'),
+    path('account/<str:pk>/export.<str:format>', views.AccountExportView.as_view(), name='account-export'),
+    path('account/<str:pk>/balance.json', views.AccountBalanceSeriesView.as_view(), name='account-balance-series'),
+    path('dashboard/', views.DashboardView.as_view(), name='dashboard'),
+    path('dashboard.json', views.DashboardJsonView.as_view(), name='dashboard-json'),
+    path('search/', views.SearchView.as_view(), name='search'),
+    path('search.json', views.SearchJsonView.as_view(), name='search-json'),
+    path('profile/', views.ProfileReportView.as_view(), name='profile-report'),
+    path('report/categories.json', views.CategoryReportView.as_view(), name='category-report'),
 ]
@@ -1,3 +1,28 @@
+from django.core.exceptions import ValidationError
 from django.core.validators import FileExtensionValidator
 
+from .parsers import decode_lines, read_statement
+from .rules import combination_error
+
 validate_csv = FileExtensionValidator(['csv', 'CSV'], 'Upload file as a CSV')
+
+validate_statement = FileExtensionValidator(['csv', 'ofx', 'qif'], 'Upload a CSV, OFX or QIF statement')
+
+def validate_statement_format(file):
+    """
+    Check that an uploaded statement is in a format finances.parsers recognises
+    Only its first lines are read
+    """
+    try:
+        read_statement(decode_lines(file.chunks()))
+    except UnicodeDecodeError:
+        raise ValidationError("Statement is not UTF-8 text")
+
+def validate_regex(value):
+    """
+    Check that a category rule's pattern compiles, alone and combined with
+    the other rules
+    """
+    error = combination_error(value)
+    if error is not None:
+        raise ValidationError("Invalid regular expression: %s" % error)
@@ -1,10 +1,303 @@
-from django.shortcuts import render
+from django.http import Http404, JsonResponse, StreamingHttpResponse
+from django.contrib.admin.views.decorators import staff_member_required
+from django.shortcuts import get_object_or_404, render
+from datetime import datetime, time, timedelta
+
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+from django.utils.decorators import method_decorator
 from django.views import generic
-from .models import Account
+from .cache import account_list_scopes, account_scopes, report_scopes, versioned_page
+from .dashboard import dashboard
+from .export import FORMATS, export_rows
+from .instrumentation import SAMPLE_RATE, worst_endpoints
+from .models import CENTS, Account, MonthlyRollup, Transaction
+from .routers import reporting
+from .search import search
+from .timeseries import BUCKETS, balance_series, downsample, ohlc
+
+LEDGER_PAGE_SIZE = 50
+LEDGER_MAX_PAGE_SIZE = 500
+SEARCH_PAGE_SIZE = 50
+SERIES_POINTS = 500
+SERIES_MAX_POINTS = 5000
+
+
+def encode_cursor(key):
+    """
+    Ledger position as a query string value
+    """
+    if key is None:
+        return None
+    timestamp, pk = key
+    return "%s_%d" % (timestamp.isoformat(), pk)
+
+
+def decode_cursor(cursor):
+    """
+    Inverse of encode_cursor
+    """
+    try:
+        timestamp, pk = cursor.rsplit("_", 1)
+        timestamp = parse_datetime(timestamp)
+        pk = int(pk)
+    except ValueError:
+        timestamp = None
+    if timestamp is None:
+        raise Http404("Invalid ledger cursor")
+    return timestamp, pk
+
+
+def parse_month(value):
+    """
+    First day of a YYYY-MM (or YYYY-MM-DD) query parameter, or None
+    """
+    if not value:
+        return None
+    try:
+        month = parse_date(value if value.count("-") == 2 else value + "-01")
+    except ValueError:
+        month = None
+    if month is None:
+        raise Http404("Invalid month: %s" % value)
+    return month.replace(day=1)
+
+
+def parse_day(value):
+    """
+    Date of a YYYY-MM-DD query parameter, or None
+    """
+    if not value:
+        return None
+    try:
+        day = parse_date(value)
+    except ValueError:
+        day = None
+    if day is None:
+        raise Http404("Invalid date: %s" % value)
+    return day
+
 
 # Create your views here.
+@method_decorator(versioned_page(account_list_scopes), name='dispatch')
 class AccountListView(generic.ListView):
     model = Account
 
+@method_decorator(versioned_page(account_scopes), name='dispatch')
 class AccountDetailView(generic.DetailView):
     model = Account
+
+class AccountLedgerMixin:
+    """
+    Keyset-paginated page of an account's transactions, newest first
+    ?before=<cursor> continues from a previous page's next cursor
+    """
+    model = Account
+
+    def get_ledger(self):
+        before = self.request.GET.get('before')
+        try:
+            limit = min(int(self.request.GET.get('limit', LEDGER_PAGE_SIZE)), LEDGER_MAX_PAGE_SIZE)
+        except ValueError:
+            limit = LEDGER_PAGE_SIZE
+        transactions, next_key = self.object.ledger(before=decode_cursor(before) if before else None,
+                                                    limit=max(limit, 1))
+        return transactions, encode_cursor(next_key)
+
+@method_decorator(versioned_page(account_scopes), name='dispatch')
+class AccountLedgerView(AccountLedgerMixin, generic.DetailView):
+    template_name = 'finances/account_ledger.html'
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context['transactions'], context['next_cursor'] = self.get_ledger()
+        return context
+
+@method_decorator(versioned_page(account_scopes), name='dispatch')
+class AccountLedgerJsonView(AccountLedgerMixin, generic.detail.BaseDetailView):
+
+    def render_to_response(self, context):
+        transactions, next_cursor = self.get_ledger()
+        return JsonResponse({
+            'account': self.object.name,
+            'transactions': [{
+                'id': t.id,
+                'timestamp': t.timestamp.isoformat(),
+                'amount': str(t.amount),
+                'description': t.description,
+                'dr': t.dr_id,
+                'cr': t.cr_id,
+                'category': t.category_id,
+                'tags': [tag.name for tag in t.tags.all()],
+            } for t in transactions],
+            'next': next_cursor,
+        })
+
+@method_decorator(versioned_page(report_scopes), name='dispatch')
+@method_decorator(reporting(), name='dispatch')
+class CategoryReportView(generic.View):
+    """
+    Monthly totals by category, from the rollup table only
+    ?account= (repeatable), ?since= and ?until= (YYYY-MM) narrow the report
+    """
+
+    def get(self, request, *args, **kwargs):
+        accounts = request.GET.getlist('account') or None
+        rows = MonthlyRollup.objects.report(accounts=accounts,
+                                            since=parse_month(request.GET.get('since')),
+                                            until=parse_month(request.GET.get('until')))
+        return JsonResponse({'months': [{
+            'month': row['month'].strftime("%Y-%m"),
+            'category': row['category'],
+            'total': str(row['total'].quantize(CENTS)),
+            'count': row['count'],
+            'min': str(row['minimum'].quantize(CENTS)),
+            'max': str(row['maximum'].quantize(CENTS)),
+        } for row in rows]})
+
+class AccountExportView(generic.View):
+    """
+    Streamed export of an account's transactions, oldest first
+    ?since= and ?until= (YYYY-MM-DD, inclusive) and ?category= narrow the
+    export; an empty ?category= selects uncategorized transactions
+    """
+
+    def get(self, request, pk, format):
+        if format not in FORMATS:
+            raise Http404("Unknown export format: %s" % format)
+        account = get_object_or_404(Account, pk=pk)
+        lines, content_type = FORMATS[format]
+        rows = export_rows(account,
+                           since=parse_day(request.GET.get('since')),
+                           until=parse_day(request.GET.get('until')),
+                           category=request.GET.get('category'))
+        response = StreamingHttpResponse(lines(rows), content_type=content_type)
+        response['Content-Disposition'] = 'attachment; filename="%s.%s"' % (account.name, format)
+        return response
+
+@method_decorator(versioned_page(account_scopes), name='dispatch')
+@method_decorator(reporting(), name='dispatch')
+class AccountBalanceSeriesView(generic.detail.BaseDetailView):
+    """
+    Balance history of an account for charting
+    ?bucket=day|week|month gives the open, high, low and close balance of
+    each bucket; otherwise ?points=N (default 500) downsamples with LTTB
+    ?since= and ?until= (YYYY-MM-DD, inclusive) narrow the history
+    """
+    model = Account
+
+    def render_to_response(self, context):
+        since = parse_day(self.request.GET.get('since'))
+        until = parse_day(self.request.GET.get('until'))
+        series = balance_series(
+            self.object,
+            since=since and timezone.make_aware(datetime.combine(since, time())),
+            until=until and timezone.make_aware(datetime.combine(until + timedelta(days=1), time())))
+        bucket = self.request.GET.get('bucket')
+        if bucket:
+            if bucket not in BUCKETS:
+                raise Http404("Unknown bucket: %s" % bucket)
+            return JsonResponse({
+                'account': self.object.name,
+                'bucket': bucket,
+                'series': [{
+                    'timestamp': timestamp.isoformat(),
+                    'open': round(row.open, 2),
+                    'high': round(row.high, 2),
+                    'low': round(row.low, 2),
+                    'close': round(row.close, 2),
+                } for timestamp, row in ohlc(series, bucket).iterrows()],
+            })
+        try:
+            points = min(int(self.request.GET.get('points', SERIES_POINTS)), SERIES_MAX_POINTS)
+        except ValueError:
+            points = SERIES_POINTS
+        return JsonResponse({
+            'account': self.object.name,
+            'points': points,
+            'series': [{
+                'timestamp': timestamp.isoformat(),
+                'balance': round(balance, 2),
+            } for timestamp, balance in downsample(series, max(points, 2)).items()],
+        })
+
+@method_decorator(staff_member_required, name='dispatch')
+class ProfileReportView(generic.TemplateView):
+    """
+    Worst endpoints of the sampled requests held in this process
+    """
+    template_name = 'finances/profile_report.html'
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context['endpoints'] = worst_endpoints()
+        context['sample_rate'] = SAMPLE_RATE
+        return context
+
+class SearchMixin:
+    """
+    Ranked page of the transactions whose description contains ?q=
+    ?account= narrows the search to one account; ?page= counts from 1
+    """
+
+    def get_results(self):
+        query = self.request.GET.get('q', '').strip()
+        try:
+            page = max(int(self.request.GET.get('page', 1)), 1)
+        except ValueError:
+            page = 1
+        if not query:
+            return query, [], page, False
+        transactions = Transaction.objects.all()
+        account = self.request.GET.get('account')
+        if account:
+            transactions = get_object_or_404(Account, pk=account).transactions()
+        results = search(transactions.select_related('category'), query,
+                         offset=(page - 1) * SEARCH_PAGE_SIZE, limit=SEARCH_PAGE_SIZE + 1)
+        return query, results[:SEARCH_PAGE_SIZE], page, len(results) > SEARCH_PAGE_SIZE
+
+class SearchView(SearchMixin, generic.TemplateView):
+    template_name = 'finances/search.html'
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context['query'], context['transactions'], context['page'], context['has_next'] = self.get_results()
+        context['account'] = self.request.GET.get('account', '')
+        return context
+
+class SearchJsonView(SearchMixin, generic.View):
+
+    def get(self, request, *args, **kwargs):
+        query, transactions, page, has_next = self.get_results()
+        return JsonResponse({
+            'query': query,
+            'page': page,
+            'transactions': [{
+                'id': t.id,
+                'timestamp': t.timestamp.isoformat(),
+                'amount': str(t.amount),
+                'description': t.description,
+                'dr': t.dr_id,
+                'cr': t.cr_id,
+                'category': t.category_id,
+            } for t in transactions],
+            'next': page + 1 if has_next else None,
+        })
+
+class DashboardView(generic.TemplateView):
+    """
+    Balances, this month's totals by category, recent transactions and the
+    number left uncategorized, queried concurrently; see finances.dashboard
+    """
+    template_name = 'finances/dashboard.html'
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context.update(dashboard())
+        return context
+
+class DashboardJsonView(generic.View):
+
+    def get(self, request, *args, **kwargs):
+        return JsonResponse(dashboard())
+
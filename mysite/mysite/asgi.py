@@ -0,0 +1,30 @@
+"""
+ASGI config for mysite project.
+
+It exposes the ASGI callable as a module-level variable named ``application``.
+
+Django only has an ASGI handler from 3.0. Before that the WSGI application
+is served through asgiref's WsgiToAsgi adapter, which runs each request on
+a thread, so ASGI servers such as uvicorn or daphne can host the site
+either way; asgiref must then be installed (pip install asgiref).
+"""
+
+import os
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "mysite.settings")
+
+try:
+    from django.core.asgi import get_asgi_application
+except ImportError:
+    try:
+        from asgiref.wsgi import WsgiToAsgi
+    except ImportError:
+        from django.core.exceptions import ImproperlyConfigured
+
+        raise ImproperlyConfigured(
+            "Serving this Django version over ASGI requires asgiref; install it with 'pip install asgiref'")
+    from django.core.wsgi import get_wsgi_application
+
+    application = WsgiToAsgi(get_wsgi_application())
+else:
+    application = get_asgi_application()
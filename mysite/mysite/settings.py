@@ -49,6 +49,7 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'finances.instrumentation.QueryProfilingMiddleware',
 ]
 
 ROOT_URLCONF = 'mysite.urls'
@@ -83,6 +84,18 @@ DATABASES = {
 }
 
 
+# Cache
+# https://docs.djangoproject.com/en/2.0/topics/cache/
+# File based, so versions bumped by the import worker reach every web process
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.path.join(BASE_DIR, 'cache'),
+    }
+}
+
+
 # Password validation
 # https://docs.djangoproject.com/en/2.0/ref/settings/#auth-password-validators
 
@@ -122,3 +135,46 @@ USE_TZ = True
 STATIC_URL = '/static/'
 
 DATA_UPLOAD_MAX_NUMBER_FIELDS = None
+
+# Finances
+# Number of rows written per INSERT when importing statements
+FINANCES_IMPORT_BATCH_SIZE = 1000
+# Keep uploaded statements in MEDIA_ROOT for the import worker; if False they
+# are imported during the upload request and not stored
+FINANCES_KEEP_STATEMENTS = True
+# Seconds after which a running import is taken to have lost its worker and is queued again
+FINANCES_IMPORT_JOB_TIMEOUT = 3600
+# Seconds a rendered page is kept; pages are also replaced as soon as their data changes
+FINANCES_PAGE_CACHE_TIMEOUT = 600
+# Days between the two statements' rows of a transfer between accounts for
+# them to be merged into one transaction
+FINANCES_TRANSFER_WINDOW_DAYS = 3
+# Columnar ledger snapshots for analytics; defaults to snapshots/ beside the database
+# FINANCES_SNAPSHOT_DIR = os.path.join(BASE_DIR, 'snapshots')
+# Threads per process running the dashboard's queries concurrently; 0 runs
+# them one after another
+FINANCES_DASHBOARD_WORKERS = 4
+# Fraction of requests whose SQL is profiled for the staff profile page
+FINANCES_PROFILE_SAMPLE_RATE = 0.1
+# Number of request profiles kept in memory by each process
+FINANCES_PROFILE_BUFFER_SIZE = 1000
+# Queries taking longer than this are logged to finances.slow_query
+FINANCES_SLOW_QUERY_MS = 100
+
+# Request profiles are logged as JSON to finances.profile at INFO and slow
+# queries to finances.slow_query at WARNING
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {
+            'class': 'logging.StreamHandler',
+        },
+    },
+    'loggers': {
+        'finances': {
+            'handlers': ['console'],
+            'level': 'WARNING',
+        },
+    },
+}
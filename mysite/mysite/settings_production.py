@@ -0,0 +1,39 @@
+"""
+Production profile of the mysite settings
+
+Use with DJANGO_SETTINGS_MODULE=mysite.settings_production. SQLite runs in
+WAL mode, so imports do not lock out readers, with persistent connections,
+and report and analytics reads go through a separate 'reports' connection.
+"""
+
+from mysite.settings import *
+
+DEBUG = False
+
+DATABASES['default'].update({
+    # Keep connections (and their page cache) open between requests
+    'CONN_MAX_AGE': 600,
+    'OPTIONS': {'timeout': 20},
+})
+
+# Applied to every new SQLite connection by finances.routers.apply_pragmas
+FINANCES_SQLITE_PRAGMAS = {
+    'journal_mode': 'WAL',
+    # Durable at each WAL checkpoint rather than each commit
+    'synchronous': 'NORMAL',
+    # 64 MB page cache (negative values are KiB)
+    'cache_size': -64000,
+    'mmap_size': 268435456,
+    'temp_store': 'MEMORY',
+}
+
+# Reads inside finances.routers.reporting() use this connection. By default it
+# is the same file; set FINANCES_REPORT_REPLICA to read from a copy refreshed
+# by manage.py refresh_report_replica instead
+FINANCES_REPORT_REPLICA = os.environ.get('FINANCES_REPORT_REPLICA')
+
+DATABASES['reports'] = dict(DATABASES['default'],
+                            NAME=FINANCES_REPORT_REPLICA or DATABASES['default']['NAME'],
+                            TEST={'MIRROR': 'default'})
+
+DATABASE_ROUTERS = ['finances.routers.ReportRouter']